@@ -0,0 +1,76 @@
+import sys
+
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
+
+if sys.implementation.name == "micropython":
+    _core = sys.modules[asyncio.__name__ + ".core"]
+
+    def _readable(sock):
+        # Park the task on the scheduler's IO queue until sock is readable
+        yield _core._io_queue.queue_read(sock)
+
+    def _wait_for(aw, timeout_ms):
+        return asyncio.wait_for_ms(aw, timeout_ms)
+else:
+    async def _readable(sock):
+        loop = asyncio.get_event_loop()
+        fut = loop.create_future()
+        loop.add_reader(sock, lambda: fut.done() or fut.set_result(None))
+        try:
+            await fut
+        finally:
+            loop.remove_reader(sock)
+
+    def _wait_for(aw, timeout_ms):
+        return asyncio.wait_for(aw, timeout_ms / 1000)
+
+async def _readable_or(sock, event, timeout_ms):
+    # Whichever comes first: sock readable (True), event set or timeout (False)
+    done = asyncio.Event()
+    result = []
+
+    async def readable():
+        await _readable(sock)
+        result.append(True)
+        done.set()
+
+    async def interrupted():
+        await event.wait()
+        result.append(False)
+        done.set()
+
+    tasks = (asyncio.create_task(readable()), asyncio.create_task(interrupted()))
+    try:
+        if timeout_ms is None:
+            await done.wait()
+        else:
+            await wait_event(done, timeout_ms)
+    finally:
+        for task in tasks:
+            task.cancel()
+    return bool(result) and result[0]
+
+async def wait_readable(sock, timeout_ms=None, event=None):
+    # True once sock has data (or an error/EOF to report), False on timeout
+    # or as soon as event (if given) is set
+    if event is not None:
+        return await _readable_or(sock, event, timeout_ms)
+    if timeout_ms is None:
+        await _readable(sock)
+        return True
+    try:
+        await _wait_for(_readable(sock), timeout_ms)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+async def wait_event(event, timeout_ms):
+    # True if event was set, False on timeout
+    try:
+        await _wait_for(event.wait(), timeout_ms)
+        return True
+    except asyncio.TimeoutError:
+        return False
@@ -0,0 +1,18 @@
+import random
+
+class Backoff:
+    # Exponential backoff with full jitter: each delay is uniform in
+    # [0, min(max_ms, base_ms * 2^attempt)]. Devices that lost the broker at
+    # the same moment spread their reconnects instead of arriving together.
+    def __init__(self, base_ms=1000, max_ms=300000):
+        self.base_ms = base_ms
+        self.max_ms = max_ms
+        self.attempt = 0
+
+    def next_delay(self):
+        cap = min(self.max_ms, self.base_ms << min(self.attempt, 16))
+        self.attempt += 1
+        return random.getrandbits(30) % (cap + 1)
+
+    def reset(self):
+        self.attempt = 0
@@ -1,14 +1,59 @@
 # boot.py -- run on boot-up
 import builtins
+import os
 import time
 import machine
+
+# Finish a multi-file update that was interrupted mid-swap before any other
+# firmware module is imported. The journal (ota.PENDING_FILE) is checked
+# first so deep-sleep wakes do not pay for importing ota and its network
+# dependencies.
+try:
+    os.stat("ota_pending.json")
+    ota_pending = True
+except OSError:
+    ota_pending = False
+if ota_pending:
+    try:
+        import ota
+        ota.apply_pending()
+    except Exception as e:
+        print("Pending OTA apply failed:", e)
+
 import config
+
+# Duty-cycle mode: most deep-sleep wakes only take a reading and go straight
+# back to sleep from here, before WiFi or the OTA check
+if config.DUTY_CYCLE and machine.reset_cause() == machine.DEEPSLEEP_RESET:
+    import dutycycle
+    dutycycle.wake()
+
+import ota
 from wifi_manager import WifiManager
 import urequests
 import gc
+import json
 
 gc.collect()
 
+OTA_STATE_FILE = "ota_state.json"
+
+def load_ota_state():
+    # {"etag": last ETag, "sha": sha it was served for, "boots": boots since
+    # the last successful check}. Boots, not time: there is no NTP at boot.
+    try:
+        with open(OTA_STATE_FILE, "r") as f:
+            return json.load(f)
+    except:
+        return {}
+
+def save_ota_state(etag, sha, boots=0):
+    try:
+        with open(OTA_STATE_FILE, "w") as f:
+            json.dump({"etag": etag, "sha": sha, "boots": boots}, f)
+    except Exception as e:
+        print("[BOOTLOADER] Failed to save OTA state:", e)
+
 def bootloader_ota_check():
     print("--- CHOKEPOINT BOOTLOADER ---")
     wm = WifiManager()
@@ -17,6 +62,15 @@ def bootloader_ota_check():
     if not ssid:
         print("No WiFi Config found. Booting direct to main.py for Provisioning...")
         return
+
+    # Skip the network entirely unless OTA_CHECK_EVERY_BOOTS boots have passed
+    # since the last successful check. No state (first boot) forces a check.
+    state = load_ota_state()
+    boots = state.get("boots", -1) + 1
+    if 0 < boots < config.OTA_CHECK_EVERY_BOOTS:
+        print("[BOOTLOADER] Last OTA check", boots, "boots ago. Skipping.")
+        save_ota_state(state.get("etag"), state.get("sha"), boots)
+        return
         
     print(f"Connecting to {ssid} for OTA Check...")
     if not wm.connect(ssid, password):
@@ -33,6 +87,22 @@ def bootloader_ota_check():
         print("GitHub Configuration missing in config.py. Skipping OTA.")
         return
 
+    # Manifest mode: fetch only the files whose hashes changed
+    if config.OTA_MANIFEST:
+        try:
+            changed = ota.github_update(config.GITHUB_OWNER, config.GITHUB_REPO, config.GITHUB_PAT, config.OTA_MANIFEST)
+            if changed is not None:
+                if changed >= 0:
+                    save_ota_state(state.get("etag"), state.get("sha"))
+                if changed > 0:
+                    print("[BOOTLOADER]", changed, "files updated. Rebooting!")
+                    time.sleep(1)
+                    machine.reset()
+                return
+        except Exception as e:
+            print("[BOOTLOADER] Manifest update failed:", e)
+            return
+
     try:
         url = f"https://api.github.com/repos/{config.GITHUB_OWNER}/{config.GITHUB_REPO}/contents/firmware/main.py"
         headers = {
@@ -40,19 +110,30 @@ def bootloader_ota_check():
             "Authorization": f"Bearer {config.GITHUB_PAT}",
             "Accept": "application/vnd.github.v3+json"
         }
+
+        local_sha = ""
+        try:
+            with open("version_sha.txt", "r") as f:
+                local_sha = f.read().strip()
+        except:
+            pass
+
+        # Conditional request: an unchanged file costs a 304 with no body.
+        # Only trust the ETag if it was stored for the firmware we are running.
+        if state.get("etag") and state.get("sha") == local_sha:
+            headers["If-None-Match"] = state["etag"]
+
         r = urequests.get(url, headers=headers)
-        if r.status_code == 200:
+        if r.status_code == 304:
+            print("[BOOTLOADER] Firmware is up to date (304).")
+            save_ota_state(state["etag"], local_sha)
+            r.close()
+        elif r.status_code == 200:
+            etag = ota.get_header(r, "ETag")
             data = r.json()
             remote_sha = data.get("sha", "")
             b64_content = data.get("content", "")
             
-            local_sha = ""
-            try:
-                with open("version_sha.txt", "r") as f:
-                    local_sha = f.read().strip()
-            except:
-                pass
-            
             if remote_sha and remote_sha != local_sha:
                 print("\n[BOOTLOADER] New firmware commit detected:", remote_sha)
                 
@@ -69,6 +150,7 @@ def bootloader_ota_check():
                             
                         with open("version_sha.txt", "w") as f:
                             f.write(remote_sha)
+                        save_ota_state(etag, remote_sha)
                             
                         print("[BOOTLOADER] Update successfully applied. Rebooting cleanly into new main.py!")
                         r.close()
@@ -80,6 +162,7 @@ def bootloader_ota_check():
                     print("[BOOTLOADER] Firmware update failed: No content array in JSON.")
             else:
                 print("[BOOTLOADER] Firmware is up to date.")
+                save_ota_state(etag, local_sha)
             
             r.close()
         else:
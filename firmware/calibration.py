@@ -1,42 +1,82 @@
-from machine import ADC, Pin
+import math
 import time
+import mq135_math
 
-# Configuration
-analog_pin = ADC(Pin(34))
-analog_pin.atten(ADC.ATTN_11DB) # For 3.3V range
-analog_pin.width(ADC.WIDTH_12BIT)
+R0_FILE = "r0_value.txt"
 
-# Voltage Divider & Sensor Constants
-RLOAD = 1.0  # The load resistor on the MQ-135 board is usually 1k Ohm
-FRESH_AIR_FACTOR = 3.6  # Clean air factor for MQ-135
+def load_r0():
+    try:
+        with open(R0_FILE, "r") as f:
+            return float(f.read().strip())
+    except:
+        return mq135_math.DEFAULT_R0
+
+def save_r0(r0):
+    try:
+        with open(R0_FILE, "w") as f:
+            f.write(str(r0))
+        print("R0 saved to", R0_FILE)
+        return True
+    except Exception as e:
+        print("Failed to save R0:", e)
+        return False
+
+class Calibrator:
+    # Running mean and variance of per-reading R0 estimates (Welford), fed
+    # one reading at a time. Converged once the standard error of the mean
+    # is within rel_tol of the mean; gives up after max_samples readings.
+    # `estimate` maps a raw code to an R0 estimate (a driver's r0_from_raw).
+    def __init__(self, estimate, min_samples=50, max_samples=600, rel_tol=0.002):
+        self.estimate = estimate
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self.rel_tol = rel_tol
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.skipped = 0
+
+    def add(self, raw):
+        r0 = self.estimate(raw)
+        if r0 is None:
+            self.skipped += 1
+            return
+        self.n += 1
+        delta = r0 - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (r0 - self.mean)
 
-def get_r0():
+    def variance(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else 0.0
+
+    def converged(self):
+        if self.n < self.min_samples:
+            return False
+        return math.sqrt(self.variance() / self.n) <= self.rel_tol * self.mean
+
+    def done(self):
+        return self.converged() or self.n + self.skipped >= self.max_samples
+
+def get_r0(samples=100):
+    # Blocking calibration for the REPL: ~10 s of readings in fresh air from
+    # the primary sensor in config.SENSORS, with its own pin and constants
+    import config
+    import sensors
+    sensor = sensors.SensorArray(config.SENSORS).primary
     print("Finding R0 in fresh air... please wait.")
-    total_r0 = 0
-    samples = 100
-    
+    cal = Calibrator(sensor.r0_from_raw, max_samples=samples)
     for _ in range(samples):
-        raw = analog_pin.read()
-        v_out = raw * (3.3 / 4095) 
-        
-        if v_out > 0.1: # Eliminate noise
-            rs = ((5.0 / v_out) - 1.0) * RLOAD
-            total_r0 += rs / FRESH_AIR_FACTOR
-        
+        cal.add(sensor.adc.read())
         time.sleep(0.1)
-    
-    final_r0 = total_r0 / samples
+
+    if not cal.n:
+        print("Calibration Failed: no valid readings")
+        return None
+    # Average over the readings actually used, not all of them
+    final_r0 = cal.mean
     print("Calibration Complete!")
-    print("Your R0 value is:", final_r0)
-    
-    # Save to file for main.py to use
-    try:
-        with open("r0_value.txt", "w") as f:
-            f.write(str(final_r0))
-        print("R0 saved to r0_value.txt")
-    except Exception as e:
-        print("Failed to save R0:", e)
-        
+    print("Your R0 value is:", final_r0, "from", cal.n, "readings")
+    save_r0(final_r0)
     return final_r0
 
 if __name__ == "__main__":
@@ -0,0 +1,70 @@
+import time
+import json
+
+# Command registry. Handlers take the command dict and return a dict that
+# is merged into the response, or None for no payload.
+_handlers = {}
+_deferred = []
+
+def command(name):
+    def register(fn):
+        _handlers[name] = fn
+        return fn
+    return register
+
+def names():
+    return sorted(_handlers)
+
+def defer(fn):
+    # Run fn after the response has been published (e.g. machine.reset)
+    _deferred.append(fn)
+
+def run_deferred():
+    while _deferred:
+        _deferred.pop(0)()
+
+def run(cmd):
+    # Execute one command; returns (result dict, handler returned a payload)
+    name = cmd.get('cmd')
+    result = {"cmd": name}
+    if 'id' in cmd:
+        result["id"] = cmd['id']
+    start = time.ticks_us()
+    payload = False
+    handler = _handlers.get(name)
+    if handler is None:
+        result["status"] = "error: unknown command"
+    else:
+        try:
+            res = handler(cmd)
+            if res is not None:
+                result.update(res)
+                payload = True
+        except Exception as e:
+            result["status"] = "error: " + str(e)
+    if "status" not in result:
+        result["status"] = "ok"
+    result["ms"] = time.ticks_diff(time.ticks_us(), start) / 1000
+    return result, payload
+
+def dispatch(msg):
+    # Accepts a single command {"cmd": ..., "id": ...} or an envelope
+    # {"id": ..., "cmds": [{"id": ..., "cmd": ...}, ...]} and returns the
+    # response to publish, or None. Malformed requests get an error response.
+    try:
+        req = json.loads(msg)
+    except ValueError as e:
+        return {"cmd": None, "status": "error: bad json: " + str(e)}
+    if not isinstance(req, dict):
+        return {"cmd": None, "status": "error: expected a JSON object"}
+    if 'cmds' in req:
+        if not isinstance(req['cmds'], list) or not all(isinstance(cmd, dict) for cmd in req['cmds']):
+            return {"id": req.get('id'), "status": "error: cmds must be a list of objects"}
+        results = [run(cmd)[0] for cmd in req['cmds']]
+        return {"id": req.get('id'), "results": results}
+
+    result, payload = run(req)
+    # Untagged legacy commands only answer when they have something to say
+    if payload or 'id' in req or not result["status"].startswith("ok"):
+        return result
+    return None
@@ -11,6 +11,122 @@ DEVICE_ID_FILE = "device_id.txt"
 GITHUB_PAT = ""   # Leave empty. Set this inside secrets.py
 GITHUB_OWNER = "Joshua-Varghese"     # Your GitHub Username
 GITHUB_REPO = "chokepoint"  
+OTA_CHECK_EVERY_BOOTS = 10 # boot.py checks for updates on every Nth boot only
+OTA_MANIFEST = "firmware/manifest.json" # Multi-file updates; "" updates main.py only
+
+# Telemetry batching: BATCH_SIZE samples go out in one message, or fewer
+# once the oldest has waited BATCH_MAX_DELAY_MS. 1 publishes every sample.
+# The sample buffer is allocated for MAX_BATCH_SIZE samples at boot.
+BATCH_SIZE = 1
+BATCH_MAX_DELAY_MS = 30000
+MAX_BATCH_SIZE = 32
+
+# Default sampling period. SAMPLE_PERIOD_MS, BATCH_SIZE and
+# BATCH_MAX_DELAY_MS can be changed per device with
+# {"cmd": "set", "key": "sample_ms" | "batch" | "publish_ms"} or a retained
+# JSON object on chokepoint/devices/{id}/config.
+SAMPLE_PERIOD_MS = 2000
+MIN_SAMPLE_PERIOD_MS = 100
+
+# WiFi modem sleep between DTIM beacons while connected (the radio still
+# receives MQTT traffic, with slightly higher latency)
+WIFI_POWERSAVE = True
+
+# Reconnect straight to the last AP (BSSID and channel) with the last DHCP
+# lease as a static config, stored in wifi.json, and fall back to a scan
+# and DHCP if that does not connect within WIFI_FAST_TIMEOUT_MS. The lease
+# is only trusted until the first broker connection: if that fails, main.py
+# drops it and rejoins with DHCP.
+WIFI_FAST_CONNECT = True
+WIFI_FAST_TIMEOUT_MS = 1500
+WIFI_FAST_MAX_JOINS = 20 # Then one join through DHCP to refresh the cached lease
+WIFI_CONNECT_TIMEOUT_MS = 20000
+
+# Link quality: sample RSSI every WIFI_RSSI_INTERVAL_MS (reported in
+# telemetry and diag). While the average is below WIFI_ROAM_RSSI, scan at
+# most every WIFI_ROAM_SCAN_INTERVAL_MS (a scan blocks for 1-2 s) and roam
+# to a BSSID of the same SSID at least WIFI_ROAM_HYSTERESIS_DB stronger.
+WIFI_RSSI_INTERVAL_MS = 10000 # 0 = off
+WIFI_ROAM_RSSI = -75
+WIFI_ROAM_HYSTERESIS_DB = 8
+WIFI_ROAM_SCAN_INTERVAL_MS = 120000
+
+# Default telemetry encoding: "json" on .../data, or "binary" (see wire.py)
+# on .../bin. Overridable per device with {"cmd": "set", "key": "format"}.
+TELEMETRY_FORMAT = "json"
+
+# Store-and-forward: readings taken while the broker is unreachable are
+# appended to flash (bounded to QUEUE_MAX_SEGMENTS * QUEUE_SEGMENT_RECORDS)
+# and replayed REPLAY_BATCH at a time every REPLAY_INTERVAL_MS on reconnect.
+QUEUE_DIR = "queue"
+QUEUE_SEGMENT_RECORDS = 256
+QUEUE_MAX_SEGMENTS = 32
+REPLAY_BATCH = 50
+REPLAY_INTERVAL_MS = 1000
+
+# MQTT reconnects back off exponentially with full jitter from
+# MQTT_BACKOFF_BASE_MS up to MQTT_BACKOFF_MAX_MS. A PINGREQ that gets no
+# traffic back within MQTT_PING_TIMEOUT_MS marks the link dead.
+MQTT_BACKOFF_BASE_MS = 1000
+MQTT_BACKOFF_MAX_MS = 300000
+MQTT_PING_TIMEOUT_MS = 10000
+MQTT_CONNECT_TIMEOUT_S = 5 # Socket timeout of a broker connect, which blocks the loop
+
+# Print per-publish logs and heap stats (free bytes, bytes allocated per
+# publish cycle) every HEAP_REPORT_CYCLES cycles
+DEBUG_HEAP = False
+HEAP_REPORT_CYCLES = 30
+
+# Publish loop latency histograms, overruns, reconnects and free heap to
+# chokepoint/devices/{id}/diag every DIAG_INTERVAL_S seconds (0 = off).
+# Overridable per device with {"cmd": "set", "key": "diag_interval"}.
+DIAG_INTERVAL_S = 300
+
+# Report by exception: only publish a sample when co2 moves more than
+# DEADBAND_ABS_PPM or DEADBAND_REL (fraction of the last published value),
+# when the error state changes, or after HEARTBEAT_S without a publish.
+# Both thresholds at 0 publishes every sample. All three can be changed per
+# device with {"cmd": "set", "key": "deadband_abs" | "deadband_rel" | "heartbeat"}.
+DEADBAND_ABS_PPM = 0.0
+DEADBAND_REL = 0.0
+HEARTBEAT_S = 300
+
+# Battery mode: deep-sleep DUTY_SLEEP_MS between single readings kept in RTC
+# memory, and only join WiFi every DUTY_PUBLISH_EVERY wakes, or right away
+# when co2 rises to DUTY_ALERT_PPM (0 = off) or the error state changes.
+# Publish wakes stay up DUTY_LISTEN_MS for commands queued by the broker.
+DUTY_CYCLE = False
+DUTY_SLEEP_MS = 60000
+DUTY_PUBLISH_EVERY = 10
+DUTY_ALERT_PPM = 2000
+DUTY_LISTEN_MS = 2000
+
+# Background recalibration: read the sensor every CAL_INTERVAL_MS and stop
+# once the standard error of the R0 mean is within CAL_REL_TOL of it (after
+# at least CAL_MIN_SAMPLES), or give up after CAL_MAX_SAMPLES readings.
+CAL_INTERVAL_MS = 100
+CAL_MIN_SAMPLES = 50
+CAL_MAX_SAMPLES = 600
+CAL_REL_TOL = 0.002
+
+# Wildcard discovery (DISCOVER:* or DISCOVER:{id prefix}*): replies are
+# spread over a random 0..DISCOVERY_MAX_DELAY_MS delay, and all replies are
+# limited to DISCOVERY_RATE per second with bursts of DISCOVERY_BURST.
+DISCOVERY_MAX_DELAY_MS = 500
+DISCOVERY_RATE = 2
+DISCOVERY_BURST = 4
+
+# Sensors sampled each period, in one pass. "driver" names a module with a
+# registered driver (mq135, mq2); "gases" picks its curves and "r0" its
+# clean-air resistance. The first sensor is primary: it supplies gas_raw,
+# drives the deadband and alerts, and is the one `recalibrate` updates.
+# MQ-135 curves: co2, nh3, co, alcohol, toluene, acetone. MQ-2: smoke, lpg, co.
+SENSORS = [
+    {"driver": "mq135", "pin": 34, "gases": ["co2", "nh3"]},
+]
+
+# Precompute ppm for all 4096 ADC codes (16 KB of RAM on the ESP32)
+PPM_TABLE = True
 
 # Load local secrets to prevent committing PATs to GitHub
 try:
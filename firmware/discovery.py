@@ -2,33 +2,110 @@ import socket
 import ubinascii
 import machine
 import select
+import json
+import random
+import time
+
+# Protocol (UDP):
+#   DISCOVER:{id}       -> HERE:{id} if id matches exactly (Android app)
+#   DISCOVER:*          -> INFO:{"id", "ip", "version", "caps"} from every device
+#   DISCOVER:{prefix}*  -> INFO:... from devices whose id starts with prefix
+# Wildcard replies are sent after a random delay so a broadcast to a whole
+# floor does not answer in one burst. All replies share a token bucket.
+
+MAX_PENDING = 8
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate # Tokens per second
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.ticks_ms()
+
+    def take(self):
+        now = time.ticks_ms()
+        self.tokens = min(self.burst, self.tokens + time.ticks_diff(now, self.last) * self.rate / 1000)
+        self.last = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
 
 class Discovery:
-    def __init__(self, port=6666):
+    def __init__(self, port=6666, version=None, caps=None, get_ip=None,
+                 max_delay_ms=500, rate=2, burst=4):
         self.port = port
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.sock.bind(('0.0.0.0', self.port))
         self.sock.setblocking(False)
+        # Registered once; check() only asks the poller
+        self.poller = select.poll()
+        self.poller.register(self.sock, select.POLLIN)
         self.device_id = ubinascii.hexlify(machine.unique_id()).decode()
+        self.version = version
+        self.caps = caps or []
+        self.get_ip = get_ip
+        self.max_delay_ms = max_delay_ms
+        self.bucket = TokenBucket(rate, burst)
+        self.pending = [] # [due ticks_ms, addr] for delayed wildcard replies
+
+    def matches(self, target):
+        if target.endswith("*"):
+            return self.device_id.startswith(target[:-1])
+        return target == self.device_id
+
+    def info(self):
+        return "INFO:" + json.dumps({
+            "id": self.device_id,
+            "ip": self.get_ip() if self.get_ip else None,
+            "version": self.version,
+            "caps": self.caps
+        })
 
     def check(self):
-        try:
-            # Check for readable data without blocking
-            r, _, _ = select.select([self.sock], [], [], 0)
-            if r:
+        # Handle every queued request
+        while self.poller.poll(0):
+            try:
                 data, addr = self.sock.recvfrom(1024)
                 msg = data.decode().strip()
-                
-                # Protocol: DISCOVER:{TARGET_ID}
-                if msg.startswith("DISCOVER:"):
-                    target_id = msg.split(":")[1]
-                    if target_id == self.device_id:
-                        print(f"Discovery matched for {self.device_id} from {addr}")
-                        response = f"HERE:{self.device_id}"
-                        self.sock.sendto(response.encode(), addr)
-                    else:
-                        # Silent drop (Stealth Mode)
-                        pass
+            except Exception as e:
+                print("Discovery Error:", e)
+                return
+
+            if not msg.startswith("DISCOVER:"):
+                continue
+            target = msg[9:]
+            if not self.matches(target):
+                continue # Silent drop (Stealth Mode)
+            if not self.bucket.take():
+                print("Discovery: rate limited", addr)
+                continue
+            if target.endswith("*"):
+                if len(self.pending) < MAX_PENDING:
+                    delay = random.getrandbits(16) % (self.max_delay_ms + 1)
+                    self.pending.append([time.ticks_add(time.ticks_ms(), delay), addr])
+            else:
+                print(f"Discovery matched for {self.device_id} from {addr}")
+                self._send("HERE:" + self.device_id, addr)
+
+    def next_due_ms(self):
+        # ms until the next delayed reply, or None if nothing is queued
+        if not self.pending:
+            return None
+        now = time.ticks_ms()
+        return max(0, min(time.ticks_diff(due, now) for due, _ in self.pending))
+
+    def flush(self):
+        # Send delayed replies whose time has come
+        now = time.ticks_ms()
+        for item in self.pending[:]:
+            if time.ticks_diff(item[0], now) <= 0:
+                self.pending.remove(item)
+                self._send(self.info(), item[1])
+
+    def _send(self, msg, addr):
+        try:
+            self.sock.sendto(msg.encode(), addr)
         except Exception as e:
             print("Discovery Error:", e)
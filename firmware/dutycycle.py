@@ -0,0 +1,105 @@
+import machine
+import struct
+import time
+from array import array
+import config
+import wire
+import calibration
+import sensors
+
+# Deep-sleep duty cycle for battery installs. Each wake takes one reading
+# and appends it to a buffer in RTC memory (kept across deep sleep), then
+# sleeps again without touching WiFi. Every DUTY_PUBLISH_EVERY wakes, or
+# on a breach, wake() returns so main.py can associate and publish.
+#
+# RTC layout: "<2sHHBB" magic, record count, wake counter, nvals, alert
+# state, then records in the binary wire layout (timestamp, gas_raw, error
+# code, then nvals gas values).
+
+MAGIC = b"D2" # "DC" buffers had no alert byte
+HEADER_FMT = "<2sHHBB"
+HEADER_SIZE = struct.calcsize(HEADER_FMT)
+RTC_MEMORY = 2048 # ESP32 user RTC memory
+
+class RtcBuffer:
+    def __init__(self, nvals=1, rtc=None):
+        self.rtc = rtc or machine.RTC()
+        self.nvals = nvals
+        self.vals_fmt = "<%df" % nvals
+        self.record_size = wire.RECORD_SIZE + 4 * nvals
+        self.capacity = (RTC_MEMORY - HEADER_SIZE) // self.record_size
+        self.buf = bytearray(HEADER_SIZE + self.capacity * self.record_size)
+        self.count = 0
+        self.wakes = 0
+        self.alert = False # Primary gas was over DUTY_ALERT_PPM at the last wake
+        data = self.rtc.memory()
+        if len(data) >= HEADER_SIZE:
+            magic, count, wakes, stored_nvals, alert = struct.unpack_from(HEADER_FMT, data, 0)
+            used = HEADER_SIZE + count * self.record_size
+            if magic == MAGIC and stored_nvals == nvals and count <= self.capacity and len(data) >= used:
+                self.count = count
+                self.wakes = wakes
+                self.alert = bool(alert)
+                self.buf[:used] = data[:used]
+
+    def last_error(self):
+        if not self.count:
+            return wire.ERR_NONE
+        off = HEADER_SIZE + (self.count - 1) * self.record_size
+        return struct.unpack_from(wire.RECORD_FMT, self.buf, off)[2]
+
+    def append(self, timestamp, raw, vals, error=None):
+        size = self.record_size
+        if self.count >= self.capacity:
+            # Full after failed publishes: drop the oldest reading
+            self.buf[HEADER_SIZE:HEADER_SIZE + (self.capacity - 1) * size] = self.buf[HEADER_SIZE + size:]
+            self.count -= 1
+        off = HEADER_SIZE + self.count * size
+        struct.pack_into(wire.RECORD_FMT, self.buf, off, timestamp, raw, wire.error_code(error))
+        off += wire.RECORD_SIZE
+        for k in range(self.nvals):
+            struct.pack_into("<f", self.buf, off + 4 * k, vals[k])
+        self.count += 1
+
+    def rows(self):
+        for i in range(self.count):
+            off = HEADER_SIZE + i * self.record_size
+            timestamp, raw, err = struct.unpack_from(wire.RECORD_FMT, self.buf, off)
+            vals = struct.unpack_from(self.vals_fmt, self.buf, off + wire.RECORD_SIZE)
+            yield [timestamp, raw] + list(vals) + [wire.ERRORS.get(err) if err else None]
+
+    def clear(self):
+        self.count = 0
+
+    def save(self):
+        struct.pack_into(HEADER_FMT, self.buf, 0, MAGIC, self.count, self.wakes, self.nvals, self.alert)
+        self.rtc.memory(self.buf[:HEADER_SIZE + self.count * self.record_size])
+
+def sleep():
+    machine.deepsleep(config.DUTY_SLEEP_MS)
+
+def wake():
+    # Called from boot.py on deep-sleep wakes. Sleeps again right away
+    # unless this wake should publish, in which case boot continues.
+    sensor_array = sensors.SensorArray(config.SENSORS)
+    sensor_array.primary.r0 = calibration.load_r0()
+    vals = array('f', [0.0] * sensor_array.nvals)
+    raw, error = sensor_array.read(vals)
+    buf = RtcBuffer(sensor_array.nvals)
+    # Breach: the primary gas (first field) crossing the alert level. It only
+    # re-arms once the gas falls 10% below the level, so a reading hovering
+    # at the level does not publish on every wake.
+    breach = wire.error_code(error) != buf.last_error()
+    if config.DUTY_ALERT_PPM:
+        if vals[0] >= config.DUTY_ALERT_PPM:
+            breach = breach or not buf.alert
+            buf.alert = True
+        elif vals[0] < config.DUTY_ALERT_PPM * 0.9:
+            buf.alert = False
+    buf.append(int(time.time()), raw, vals, error)
+    buf.wakes += 1
+    if buf.wakes < config.DUTY_PUBLISH_EVERY and not breach:
+        buf.save()
+        sleep()
+    buf.wakes = 0
+    buf.save()
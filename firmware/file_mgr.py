@@ -1,7 +1,35 @@
 import os
 import ujson
+import ubinascii
+
+CHUNK_SIZE = 1024 # Default and maximum bytes per read/write chunk
+TREE_PAGE = 50 # Default and maximum entries per tree page
+
+S_IFDIR = 0x4000
+
+def _ilistdir(path):
+    # (name, type, size) per entry; os.ilistdir gives type (and usually size)
+    # without a stat call per file
+    if hasattr(os, "ilistdir"):
+        for entry in os.ilistdir(path):
+            size = entry[3] if len(entry) > 3 else -1
+            yield entry[0], entry[1], size
+    else:
+        for name in os.listdir(path or "."):
+            st = os.stat(_join(path, name))
+            yield name, st[0] & 0xF000, st[6]
+
+def _join(base, name):
+    if base in ("", "."):
+        return name
+    return base.rstrip("/") + "/" + name
 
 class FileManager:
+    def __init__(self, chunk_size=CHUNK_SIZE):
+        # Chunked transfers reuse one buffer: the device never holds more than a chunk
+        self.buf = bytearray(chunk_size)
+        self.mv = memoryview(self.buf)
+
     def list_files(self):
         try:
             return os.listdir()
@@ -36,3 +64,84 @@ class FileManager:
             return {"size": stat[6]} # Size in bytes
         except:
             return {"size": -1}
+
+    def read_chunk(self, filename, offset=0, length=CHUNK_SIZE):
+        # Binary-safe read of up to `length` bytes at `offset`, base64 encoded
+        # with a CRC32 of the raw bytes
+        try:
+            length = max(0, min(int(length), len(self.buf)))
+            size = os.stat(filename)[6]
+            with open(filename, 'rb') as f:
+                f.seek(offset)
+                n = f.readinto(self.mv[:length]) or 0
+            chunk = self.mv[:n]
+            return {
+                "offset": offset,
+                "length": n,
+                "size": size,
+                "eof": offset + n >= size,
+                "data": ubinascii.b2a_base64(chunk).decode().strip(),
+                "crc": ubinascii.crc32(chunk),
+                "status": "ok"
+            }
+        except Exception as e:
+            return {"offset": offset, "status": "error: " + str(e)}
+
+    def write_chunk(self, filename, data, offset=0, append=False, crc=None):
+        # Writes one base64 chunk. offset 0 starts a new file, a larger offset
+        # overwrites in place, append=True adds to the end. A CRC mismatch
+        # leaves the file untouched.
+        try:
+            chunk = ubinascii.a2b_base64(data)
+            if len(chunk) > len(self.buf):
+                return {"status": "error: chunk larger than %d bytes" % len(self.buf)}
+            if crc is not None and ubinascii.crc32(chunk) != crc:
+                return {"status": "error: crc mismatch"}
+            if append:
+                mode = 'ab'
+            elif offset == 0:
+                mode = 'wb'
+            else:
+                mode = 'r+b'
+            with open(filename, mode) as f:
+                if mode == 'r+b':
+                    f.seek(offset)
+                f.write(chunk)
+            size = os.stat(filename)[6]
+            # An append lands at the old end of the file
+            return {"offset": size - len(chunk) if append else offset, "length": len(chunk),
+                    "size": size, "status": "ok"}
+        except Exception as e:
+            return {"status": "error: " + str(e)}
+
+    def walk(self, path=""):
+        # (path, is_dir, size) for everything under path, one directory at a time
+        stack = [path]
+        while stack:
+            base = stack.pop()
+            for name, kind, size in _ilistdir(base):
+                full = _join(base, name)
+                is_dir = kind == S_IFDIR
+                if size < 0 and not is_dir:
+                    size = os.stat(full)[6]
+                yield full, is_dir, size
+                if is_dir:
+                    stack.append(full)
+
+    def tree(self, path="", cursor=0, limit=TREE_PAGE):
+        # One page of the recursive listing. `next` is the cursor for the
+        # following page, or None when the walk is complete. Pages never
+        # exceed TREE_PAGE entries, so a response fits one MQTT packet.
+        entries = []
+        try:
+            cursor = max(0, int(cursor))
+            limit = max(1, min(int(limit), TREE_PAGE))
+            for i, (name, is_dir, size) in enumerate(self.walk(path)):
+                if i < cursor:
+                    continue
+                if len(entries) >= limit:
+                    return {"entries": entries, "next": i, "status": "ok"}
+                entries.append({"name": name, "type": "d" if is_dir else "f", "size": 0 if is_dir else size})
+            return {"entries": entries, "next": None, "status": "ok"}
+        except Exception as e:
+            return {"entries": entries, "next": None, "status": "error: " + str(e)}
@@ -0,0 +1,162 @@
+import os
+import struct
+import wire
+
+# Store-and-forward queue for readings taken while the broker is unreachable.
+#
+# Records use the binary wire layout (timestamp, gas_raw, error code, then
+# nvals gas values) and are only ever appended to numbered segment files,
+# <dir>/00000012.bin. <dir>/nvals records the layout; segments written with
+# a different sensor configuration are discarded.
+# Fully replayed segments are deleted whole; when the queue is over its
+# bound the oldest segment is dropped. The read position lives in RAM, so a
+# reboot mid-replay resends at most one segment (at-least-once delivery).
+
+class FlashQueue:
+    def __init__(self, path="queue", segment_records=256, max_segments=32, nvals=1):
+        self.path = path
+        self.segment_records = segment_records
+        self.max_segments = max_segments
+        self.nvals = nvals
+        self.vals_fmt = "<%df" % nvals
+        self.record_size = wire.RECORD_SIZE + struct.calcsize(self.vals_fmt)
+        self.buf = bytearray(self.record_size)
+        try:
+            os.mkdir(path)
+        except OSError:
+            pass
+
+        self.segments = []
+        for name in os.listdir(path):
+            if name.endswith(".bin"):
+                self.segments.append(int(name[:-4]))
+        self.segments.sort()
+        self._check_layout()
+
+        self.read_offset = 0 # Records already replayed from segments[0]
+        self.write_count = 0 # Records in segments[-1]
+        self.roll = False    # Start a new segment on the next append
+        if self.segments:
+            size = self._size(self.segments[-1])
+            self.write_count = size // self.record_size
+            # Torn write from a power cut: keep appends aligned in a fresh segment
+            self.roll = size % self.record_size != 0
+
+    def _check_layout(self):
+        meta = self.path + "/nvals"
+        try:
+            with open(meta, 'r') as f:
+                stored = int(f.read())
+        except:
+            stored = 1 if self.segments else None # Queues predating the meta file
+        if stored != self.nvals:
+            if self.segments:
+                print("Queue layout changed, dropping", len(self.segments), "segments")
+            for seq in self.segments:
+                self._remove(seq)
+            self.segments = []
+            with open(meta, 'w') as f:
+                f.write(str(self.nvals))
+
+    def _name(self, seq):
+        return "%s/%08d.bin" % (self.path, seq)
+
+    def _size(self, seq):
+        try:
+            return os.stat(self._name(seq))[6]
+        except OSError:
+            return 0
+
+    def _records(self, seq):
+        if seq == self.segments[-1]:
+            return self.write_count
+        return self._size(seq) // self.record_size
+
+    def pending(self):
+        if not self.segments:
+            return 0
+        n = self.write_count - self.read_offset
+        for seq in self.segments[:-1]:
+            n += self._records(seq)
+        return n
+
+    def _writable(self):
+        # Segment the next record goes to, starting a new one when needed
+        if not self.segments or self.write_count >= self.segment_records or self.roll:
+            self.segments.append(self.segments[-1] + 1 if self.segments else 0)
+            self.write_count = 0
+            self.roll = False
+            if len(self.segments) > self.max_segments:
+                # Bounded: drop the oldest readings
+                self._remove(self.segments.pop(0))
+                self.read_offset = 0
+        return self.segments[-1]
+
+    def _pack(self, timestamp, raw, vals, error, offset):
+        struct.pack_into(wire.RECORD_FMT, self.buf, 0, timestamp, raw, wire.error_code(error))
+        for k in range(self.nvals):
+            struct.pack_into("<f", self.buf, wire.RECORD_SIZE + 4 * k, vals[offset + k])
+
+    def append(self, timestamp, raw, vals, error=None, offset=0):
+        # Stores vals[offset:offset + nvals]
+        seq = self._writable()
+        self._pack(timestamp, raw, vals, error, offset)
+        with open(self._name(seq), 'ab') as f:
+            f.write(self.buf)
+        self.write_count += 1
+
+    def append_many(self, rows):
+        # Stores rows [timestamp, gas_raw, *vals, error] through one open
+        # handle per segment: on LittleFS every close rewrites the file's
+        # tail block, so a spill costs one close instead of one per record
+        f = None
+        seq = None
+        try:
+            for row in rows:
+                if self._writable() != seq:
+                    if f:
+                        f.close()
+                    seq = self.segments[-1]
+                    f = open(self._name(seq), 'ab')
+                self._pack(row[0], row[1], row, row[-1], 2)
+                f.write(self.buf)
+                self.write_count += 1
+        finally:
+            if f:
+                f.close()
+
+    def read(self, n):
+        # Up to n oldest rows [timestamp, gas_raw, *vals, error] without
+        # consuming them; call commit() once they are delivered
+        if not self.segments:
+            return []
+        seq = self.segments[0]
+        n = min(n, self._records(seq) - self.read_offset)
+        if n <= 0:
+            return []
+        with open(self._name(seq), 'rb') as f:
+            f.seek(self.read_offset * self.record_size)
+            data = f.read(n * self.record_size)
+        rows = []
+        for i in range(len(data) // self.record_size):
+            off = i * self.record_size
+            timestamp, raw, err = struct.unpack_from(wire.RECORD_FMT, data, off)
+            vals = struct.unpack_from(self.vals_fmt, data, off + wire.RECORD_SIZE)
+            rows.append([timestamp, raw] + list(vals) + [wire.ERRORS.get(err) if err else None])
+        return rows
+
+    def commit(self, n):
+        self.read_offset += n
+        seq = self.segments[0]
+        if self.read_offset >= self._records(seq):
+            self._remove(seq)
+            self.segments.pop(0)
+            self.read_offset = 0
+            if not self.segments:
+                self.write_count = 0
+
+    def _remove(self, seq):
+        try:
+            os.remove(self._name(seq))
+        except OSError:
+            pass
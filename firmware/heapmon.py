@@ -0,0 +1,33 @@
+import gc
+
+# gc.mem_alloc() is MicroPython-only; report zero elsewhere
+_mem_alloc = getattr(gc, "mem_alloc", lambda: 0)
+_mem_free = getattr(gc, "mem_free", lambda: 0)
+
+class HeapMonitor:
+    # Bytes allocated per publish cycle, from gc.mem_alloc() deltas. Cycles
+    # in which a collection ran are skipped since the delta is meaningless.
+    def __init__(self, report_every=30):
+        self.report_every = report_every
+        self.last = _mem_alloc()
+        self.reset()
+
+    def reset(self):
+        self.cycles = 0
+        self.total = 0
+        self.peak = 0
+
+    def tick(self):
+        now = _mem_alloc()
+        delta = now - self.last
+        self.last = now
+        if delta < 0:
+            return
+        self.cycles += 1
+        self.total += delta
+        if delta > self.peak:
+            self.peak = delta
+        if self.cycles >= self.report_every:
+            print("Heap: free", _mem_free(), "alloc/cycle", self.total // self.cycles, "peak", self.peak)
+            self.reset()
+            self.last = _mem_alloc()
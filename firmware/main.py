@@ -1,4 +1,5 @@
 import time
+import math
 import machine
 import ubinascii
 import json
@@ -11,6 +12,19 @@ from discovery import Discovery
 import file_mgr
 import mq135_math
 import calibration
+import telemetry
+import wire
+from settings import Settings
+import aio_util
+import commands
+import flashq
+import sensors
+from array import array
+import dutycycle
+import metrics
+from heapmon import HeapMonitor
+from backoff import Backoff
+from aio_util import asyncio
 print("Testing here")
 # --- Global State ---
 device_id = ubinascii.hexlify(machine.unique_id()).decode()
@@ -18,6 +32,49 @@ wm = WifiManager()
 mqtt = None
 discovery_service = None
 fm = file_mgr.FileManager()
+settings = Settings({
+    "format": config.TELEMETRY_FORMAT,
+    "diag_interval": config.DIAG_INTERVAL_S,
+    "deadband_abs": config.DEADBAND_ABS_PPM,
+    "deadband_rel": config.DEADBAND_REL,
+    "heartbeat": config.HEARTBEAT_S,
+    "sample_ms": config.SAMPLE_PERIOD_MS,
+    "publish_ms": config.BATCH_MAX_DELAY_MS,
+    "batch": config.BATCH_SIZE
+}, minimums={
+    "diag_interval": 0, # 0 = off
+    "deadband_abs": 0,
+    "deadband_rel": 0,
+    "heartbeat": 0,
+    "sample_ms": config.MIN_SAMPLE_PERIOD_MS,
+    "publish_ms": 0,
+    "batch": 1
+}, maximums={
+    "batch": config.MAX_BATCH_SIZE # The sample buffer's capacity
+}, choices={
+    "format": ("json", "binary")
+})
+# Topics are encoded once; publishes reuse the same bytes
+data_topic = ("chokepoint/devices/%s/data" % device_id).encode()
+batch_topic = ("chokepoint/devices/%s/batch" % device_id).encode() # Consumers of data expect one flat reading
+bin_topic = ("chokepoint/devices/%s/bin" % device_id).encode()
+info_sent_ip = None # IP announced in the last binary info frame
+cmd_topic = ("chokepoint/devices/%s/cmd" % device_id).encode()
+res_topic = ("chokepoint/devices/%s/res" % device_id).encode()
+diag_topic = ("chokepoint/devices/%s/diag" % device_id).encode()
+config_topic = ("chokepoint/devices/%s/config" % device_id).encode()
+stats = metrics.Metrics()
+local_ip = "Unknown" # Cached; refreshed only when connectivity changes
+wifi_up = None
+heap = HeapMonitor(config.HEAP_REPORT_CYCLES) if config.DEBUG_HEAP else None
+mqtt_connected = False
+link_up = None # Event set on every (re)connect; wakes the backlog replay
+link_down = None # Event set by a publisher that saw the connection fail
+reschedule = None # Event set when the sample period changes
+calibrating = False
+backoff = Backoff(config.MQTT_BACKOFF_BASE_MS, config.MQTT_BACKOFF_MAX_MS)
+
+MQTT_KEEPALIVE = 60
 
 # ---- OTA UPGRADE CHECK ----
 CURRENT_VERSION = "1.0.0"
@@ -29,6 +86,18 @@ def check_for_updates():
 
     print("Checking GitHub for OTA updates...")
     try:
+        if config.OTA_MANIFEST:
+            changed = ota.github_update(config.GITHUB_OWNER, config.GITHUB_REPO, config.GITHUB_PAT, config.OTA_MANIFEST)
+            if changed:
+                if changed > 0:
+                    print("Update successfully applied. Rebooting!")
+                    time.sleep(1)
+                    machine.reset()
+                else:
+                    print("Firmware update download failed.")
+            if changed is not None:
+                return
+
         url = f"https://api.github.com/repos/{config.GITHUB_OWNER}/{config.GITHUB_REPO}/contents/firmware/main.py"
         headers = {
             "User-Agent": "ESP32-Chokepoint",
@@ -59,7 +128,7 @@ def check_for_updates():
                 }
                 
                 updater = ota.OTAUpdater()
-                success = updater.simple_update(url, headers=headers_raw)
+                success = updater.simple_update(url, headers=headers_raw, sha=remote_sha, size=data.get("size"))
                 
                 if success:
                     with open("version_sha.txt", "w") as f:
@@ -79,48 +148,500 @@ def check_for_updates():
     except Exception as e:
         print("Update check failed:", e)
 
-# --- Real MQ135 Analog Sensor Init ---
-mq = machine.ADC(machine.Pin(34))
-mq.atten(machine.ADC.ATTN_11DB) # Read full 3.3V range
-# --- Real MQ135 Analog Sensor Init ---
-mq = machine.ADC(machine.Pin(34))
-mq.atten(machine.ADC.ATTN_11DB) # Read full 3.3V range
+# --- Sensors (config.SENSORS) ---
+sensor_array = sensors.SensorArray(config.SENSORS)
+fields = sensor_array.fields
+reading = array('f', [0.0] * sensor_array.nvals) # Reused every sample
+reading_json = telemetry.ReadingJson(device_id, fields)
+encoder = wire.Encoder(capacity=config.MAX_BATCH_SIZE, nvals=sensor_array.nvals)
+
+# --- Commands ---
+@commands.command('reset')
+@commands.command('restart')
+def cmd_reset(cmd):
+    commands.defer(machine.reset)
+
+@commands.command('reset_wifi')
+def cmd_reset_wifi(cmd):
+    print("Received Factory Reset Command!")
+    wm.reset_config()
+    commands.defer(machine.reset)
+
+@commands.command('ping')
+def cmd_ping(cmd):
+    mqtt.publish(f"chokepoint/devices/{device_id}/status", "pong")
+
+@commands.command('ls')
+def cmd_ls(cmd):
+    return {"files": fm.list_files()}
+
+@commands.command('tree')
+def cmd_tree(cmd):
+    # Recursive listing with type and size: {"cmd": "tree", "path", "cursor", "limit"}
+    res = fm.tree(cmd.get('path', ''), cmd.get('cursor', 0), cmd.get('limit', file_mgr.TREE_PAGE))
+    res["path"] = cmd.get('path', '')
+    res["cursor"] = cmd.get('cursor', 0)
+    return res
+
+@commands.command('read')
+def cmd_read(cmd):
+    if 'offset' in cmd or 'length' in cmd:
+        # Chunked read: {"cmd": "read", "path", "offset", "length"}
+        res = fm.read_chunk(cmd.get('path', ''), cmd.get('offset', 0), cmd.get('length', file_mgr.CHUNK_SIZE))
+        res["path"] = cmd.get('path', '')
+        return res
+    return {"path": cmd.get('path', ''), "content": fm.read_file(cmd.get('path', ''))}
+
+@commands.command('write')
+def cmd_write(cmd):
+    if 'data' in cmd:
+        # Chunked write: {"cmd": "write", "path", "data" (base64), "offset" | "mode": "append", "crc"}
+        res = fm.write_chunk(cmd.get('path', ''), cmd['data'], cmd.get('offset', 0), cmd.get('mode') == 'append', cmd.get('crc'))
+        res["path"] = cmd.get('path', '')
+        if "offset" not in res:
+            res["offset"] = cmd.get('offset', 0)
+        return res
+    return {"path": cmd.get('path', ''), "status": fm.write_file(cmd.get('path', ''), cmd.get('content', ''))}
+
+@commands.command('rm')
+def cmd_rm(cmd):
+    return {"path": cmd.get('path', ''), "status": fm.delete_file(cmd.get('path', ''))}
+
+@commands.command('recalibrate')
+def cmd_recalibrate(cmd):
+    # Runs in the background next to telemetry; the result is published on
+    # the res topic when it converges
+    global calibrating
+    if calibrating:
+        return {"status": "error: already calibrating"}
+    print("Received Recalibrate Command! Running calibration...")
+    asyncio.create_task(calibrate_task(cmd.get('id')))
+    calibrating = True
+    mqtt.publish(f"chokepoint/devices/{device_id}/status", "recalibrating")
+    return {"status": "calibrating"}
+
+@commands.command('stats')
+def cmd_stats(cmd):
+    # Current diagnostics interval so far: {"cmd": "stats"}
+    return stats.summary()
+
+def apply_setting(key, value):
+    status = settings.set(key, value)
+    if status == "ok" and key == "sample_ms" and reschedule:
+        reschedule.set()
+    return status
+
+@commands.command('set')
+def cmd_set(cmd):
+    status = apply_setting(cmd.get('key', ''), cmd.get('value'))
+    return {"key": cmd.get('key', ''), "value": settings.get(cmd.get('key', '')), "status": status}
+
+def apply_config(msg):
+    # Retained {"key": value, ...} on the config topic; same keys as `set`
+    try:
+        for key, value in json.loads(msg).items():
+            print("Config:", key, "=", value, apply_setting(key, value))
+    except Exception as e:
+        print("Config Error:", e)
 
 def mqtt_callback(topic, msg):
+    # Single commands or {"id", "cmds": [...]} envelopes; results are tagged
+    # with the request id, status and execution time in one response
     print("MSG:", topic, msg)
+    if topic == config_topic:
+        apply_config(msg)
+        return
     try:
-        cmd = json.loads(msg)
-        if cmd.get('cmd') == 'reset':
-            machine.reset()
-        elif cmd.get('cmd') == 'reset_wifi':
-            print("Received Factory Reset Command!")
-            wm.reset_config()
-            time.sleep(1)
-            machine.reset()
-        elif cmd.get('cmd') == 'ping':
-            mqtt.publish(f"chokepoint/devices/{device_id}/status", "pong")
-        elif cmd.get('cmd') == 'ls':
-            files = fm.list_files()
-            mqtt.publish(f"chokepoint/devices/{device_id}/res", json.dumps({"cmd": "ls", "files": files}))
-        elif cmd.get('cmd') == 'read':
-            content = fm.read_file(cmd.get('path', ''))
-            mqtt.publish(f"chokepoint/devices/{device_id}/res", json.dumps({"cmd": "read", "path": cmd.get('path', ''), "content": content}))
-        elif cmd.get('cmd') == 'write':
-            status = fm.write_file(cmd.get('path', ''), cmd.get('content', ''))
-            mqtt.publish(f"chokepoint/devices/{device_id}/res", json.dumps({"cmd": "write", "path": cmd.get('path', ''), "status": status}))
-        elif cmd.get('cmd') == 'rm':
-            status = fm.delete_file(cmd.get('path', ''))
-            mqtt.publish(f"chokepoint/devices/{device_id}/res", json.dumps({"cmd": "rm", "path": cmd.get('path', ''), "status": status}))
-        elif cmd.get('cmd') == 'recalibrate':
-            print("Received Recalibrate Command! Running calibration...")
-            mqtt.publish(f"chokepoint/devices/{device_id}/status", "recalibrating")
-            calibration.get_r0()
-            time.sleep(1)
-            machine.reset()
-        elif cmd.get('cmd') == 'restart':
-            machine.reset()
-    except:
-        pass
+        res = commands.dispatch(msg)
+        if res is not None:
+            mqtt.publish(res_topic, json.dumps(res))
+    except Exception as e:
+        print("Command Error:", e)
+    commands.run_deferred()
+
+def current_ip():
+    global local_ip, wifi_up
+    up = wm.sta_if.isconnected()
+    if up != wifi_up:
+        wifi_up = up
+        local_ip = wm.sta_if.ifconfig()[0] if up else "Unknown"
+    return local_ip
+
+def publish_reading(timestamp, raw_gas, vals, offset, sensor_error, local_ip):
+    # One sample; its gas values are vals[offset:offset + len(fields)]
+    if settings.get("format") == "binary":
+        publish_info(local_ip)
+        t = time.ticks_us()
+        encoder.reset()
+        encoder.add_vals(timestamp, raw_gas, sensor_error, vals, offset)
+        stats.record(metrics.ENCODE, t)
+        t = time.ticks_us()
+        mqtt.publish(bin_topic, encoder.frame())
+        stats.record(metrics.PUBLISH, t)
+        if config.DEBUG_HEAP:
+            print("Pub bin:", raw_gas, vals[offset])
+        return
+
+    if sensor_error is None:
+        t = time.ticks_us()
+        reading_json.set_ip(local_ip)
+        payload = reading_json.write(timestamp, raw_gas, vals, offset, wm.rssi)
+        if payload is not None:
+            stats.record(metrics.ENCODE, t)
+            t = time.ticks_us()
+            mqtt.publish(data_topic, payload)
+            stats.record(metrics.PUBLISH, t)
+            if config.DEBUG_HEAP:
+                print("Pub:", raw_gas, vals[offset])
+            return
+
+    # Error readings (and out-of-range values) take the slow path
+    t = time.ticks_us()
+    data = telemetry.reading_dict(device_id, local_ip, fields, timestamp, raw_gas, vals, offset, sensor_error, wm.rssi)
+    payload = json.dumps(data)
+    stats.record(metrics.ENCODE, t)
+    t = time.ticks_us()
+    mqtt.publish(data_topic, payload)
+    stats.record(metrics.PUBLISH, t)
+    print("Pub:", payload)
+
+def publish_batch(rows, local_ip, frame_encoder=encoder):
+    if settings.get("format") == "binary":
+        publish_info(local_ip)
+        t = time.ticks_us()
+        topic, payload = bin_topic, telemetry.batch_binary(frame_encoder, rows)
+    else:
+        t = time.ticks_us()
+        topic, payload = batch_topic, telemetry.batch_json(device_id, local_ip, rows, fields, wm.rssi)
+    stats.record(metrics.ENCODE, t)
+    t = time.ticks_us()
+    mqtt.publish(topic, payload)
+    stats.record(metrics.PUBLISH, t)
+
+def publish_info(local_ip):
+    # Static fields only travel on connect or when the IP changes
+    global info_sent_ip
+    if local_ip != info_sent_ip:
+        mqtt.publish(bin_topic, wire.encode_info(device_id, local_ip, fields))
+        info_sent_ip = local_ip
+
+def new_mqtt_client():
+    client = MQTTClient(
+        client_id=device_id,
+        server=config.MQTT_BROKER,
+        port=config.MQTT_PORT,
+        user=config.MQTT_USER,
+        password=config.MQTT_PASS,
+        keepalive=MQTT_KEEPALIVE
+    )
+    client.set_callback(mqtt_callback)
+    return client
+
+def mqtt_connect():
+    # Persistent session: the broker keeps our QoS 1 subscription and queues
+    # commands while we are away, so we only resubscribe if it lost the session
+    global info_sent_ip, mqtt_connected, wifi_up
+    try: mqtt.sock.close()
+    except: pass
+    info_sent_ip = None # Re-announce static fields on connect
+    wifi_up = None # A reconnect may follow a WiFi rejoin with a new IP
+    # The connect runs on the event loop: bound it so a black-holed broker
+    # stalls sampling for seconds, not the whole TCP retry period
+    t = time.ticks_us()
+    try:
+        session = mqtt.connect(clean_session=False, timeout=config.MQTT_CONNECT_TIMEOUT_S)
+    finally:
+        stats.record(metrics.CONNECT, t)
+    if not session:
+        mqtt.subscribe(cmd_topic, qos=1)
+        mqtt.subscribe(config_topic, qos=1)
+    mqtt_connected = True
+
+def mqtt_first_connect():
+    # First broker connection of this boot. WiFi may have come up on the
+    # cached lease, which a failure here can mean is stale: renew it with
+    # DHCP and try once more.
+    try:
+        mqtt_connect()
+    except Exception as e:
+        if not wm.fast_joined():
+            raise
+        print("MQTT Connect Failed on the cached lease:", e)
+        if not wm.renew_lease():
+            raise
+        mqtt_connect()
+
+async def mqtt_reconnect():
+    # BACKOFF -> CONNECTING, repeated until connected. Only the connect
+    # itself blocks; sampling and spooling to flash carry on meanwhile.
+    while True:
+        delay = backoff.next_delay()
+        print("MQTT: Reconnecting in", delay, "ms")
+        await asyncio.sleep_ms(delay)
+        try:
+            mqtt_connect()
+            backoff.reset()
+            stats.reconnects += 1
+            print("MQTT Reconnected!")
+            link_up.set()
+            return
+        except Exception as e:
+            print("MQTT Reconnect Failed:", e)
+
+def drop_link():
+    # A publish failed: mark the link down and wake mqtt_task to reconnect
+    global mqtt_connected
+    mqtt_connected = False
+    if link_down:
+        link_down.set()
+
+async def mqtt_task():
+    # CONNECTED: wake on incoming data and ping when idle so batched/quiet
+    # devices keep the session. Any received packet proves the link is alive;
+    # a ping with no traffic back within MQTT_PING_TIMEOUT_MS means it is dead.
+    # Publishers that hit a dead socket set link_down, which ends the wait.
+    global mqtt_connected
+    ping_sent = None
+    while True:
+        if not mqtt_connected:
+            link_down.clear()
+            await mqtt_reconnect()
+            ping_sent = None
+        try:
+            if ping_sent is None:
+                timeout = MQTT_KEEPALIVE * 500
+            else:
+                timeout = max(0, time.ticks_diff(time.ticks_add(ping_sent, config.MQTT_PING_TIMEOUT_MS), time.ticks_ms()))
+            if await aio_util.wait_readable(mqtt.sock, timeout, link_down):
+                ping_sent = None
+                t = time.ticks_us()
+                mqtt.check_msg()
+                stats.record(metrics.CHECK_MSG, t)
+            elif not mqtt_connected:
+                continue # Dropped by a publisher
+            elif ping_sent is None:
+                mqtt.ping()
+                ping_sent = time.ticks_ms()
+            else:
+                raise OSError("keepalive timeout")
+        except OSError as e:
+            print("MQTT Error:", e)
+            mqtt_connected = False
+
+async def discovery_task():
+    # Wake on a request or when a delayed wildcard reply is due
+    while True:
+        await aio_util.wait_readable(discovery_service.sock, discovery_service.next_due_ms())
+        t = time.ticks_us()
+        discovery_service.check()
+        discovery_service.flush()
+        stats.record(metrics.DISCOVERY, t)
+
+async def diag_task():
+    # Publish and reset the per-interval summary; 0 disables
+    while True:
+        interval = settings.get("diag_interval")
+        if not interval:
+            await asyncio.sleep(60)
+            continue
+        await asyncio.sleep(interval)
+        if not mqtt_connected:
+            continue
+        try:
+            summary = stats.summary()
+            summary["wifi"] = wm.link_quality()
+            mqtt.publish(diag_topic, json.dumps(summary))
+            stats.reset()
+        except OSError as e:
+            print("Diag Publish Failed:", e)
+            drop_link()
+
+async def wifi_task():
+    # RSSI sampling and roaming; a roam can come back with a new IP
+    global wifi_up
+    while True:
+        await asyncio.sleep_ms(config.WIFI_RSSI_INTERVAL_MS)
+        if wm.sta_if.isconnected() and wm.check_link():
+            wifi_up = None
+
+def read_sensor():
+    # One acquisition pass over every sensor into `reading`
+    t = time.ticks_us()
+    raw_gas, sensor_error = sensor_array.read(reading)
+    stats.record(metrics.ADC_READ, t)
+    return raw_gas, sensor_error
+
+async def sensor_task(samples, sample_ready):
+    deadline = time.ticks_ms()
+    deadband = telemetry.Deadband()
+    while True:
+        raw_gas, sensor_error = read_sensor()
+        # Deadband on the primary gas
+        if deadband.keep(reading[0], sensor_error, settings.get("deadband_abs"),
+                         settings.get("deadband_rel"), settings.get("heartbeat") * 1000):
+            samples.append(int(time.time()), raw_gas, reading, sensor_error)
+            sample_ready.set()
+        else:
+            stats.suppressed += 1
+
+        period = max(config.MIN_SAMPLE_PERIOD_MS, settings.get("sample_ms"))
+        deadline = time.ticks_add(deadline, period)
+        late = time.ticks_diff(time.ticks_ms(), deadline)
+        if late > 0:
+            # Overran, resync. Counts every period missed, e.g. all of them
+            # behind a broker connect that stalled the loop.
+            deadline = time.ticks_ms()
+            stats.overruns += 1 + late // period
+        # Idle until the deadline; a new period takes effect immediately
+        if await aio_util.wait_event(reschedule, max(0, time.ticks_diff(deadline, time.ticks_ms()))):
+            reschedule.clear()
+            deadline = time.ticks_ms()
+
+def spill(samples, queue):
+    # Broker unreachable: keep the readings on flash instead of losing them
+    queue.append_many(samples.rows())
+    print("Queued", samples.count, "samples on flash,", queue.pending(), "pending")
+    samples.clear()
+
+async def publish_task(samples, sample_ready, queue):
+    global mqtt_connected
+    while True:
+        samples.max_delay_ms = settings.get("publish_ms")
+        samples.size = settings.get("batch")
+        if samples.count == 0:
+            await sample_ready.wait()
+        elif samples.size > 1:
+            # Batch pending: wake on the next sample or when its max delay runs out
+            remaining = samples.max_delay_ms - time.ticks_diff(time.ticks_ms(), samples.first_ms)
+            await aio_util.wait_event(sample_ready, max(0, remaining))
+        sample_ready.clear()
+
+        if samples.count == 0 or (samples.size > 1 and not samples.due()):
+            continue
+        if not mqtt_connected:
+            spill(samples, queue)
+            continue
+
+        ip = current_ip()
+        try:
+            if samples.size > 1:
+                publish_batch(samples.rows(), ip)
+                print("Pub batch:", samples.count, "samples")
+            else:
+                for n in range(samples.count):
+                    i = samples.slot(n)
+                    publish_reading(samples.timestamps[i], samples.raw[i], samples.vals, i * samples.nvals, samples.errors[i], ip)
+            samples.clear()
+        except OSError as e:
+            print("Publish Failed:", e)
+            drop_link()
+            spill(samples, queue)
+        if heap:
+            heap.tick()
+
+async def replay_task(queue):
+    # Drain the flash backlog in batches at a bounded rate, alongside live data
+    global mqtt_connected
+    replay_encoder = wire.Encoder(capacity=config.REPLAY_BATCH, nvals=sensor_array.nvals)
+    while True:
+        await link_up.wait()
+        link_up.clear()
+        while mqtt_connected and queue.pending():
+            rows = queue.read(config.REPLAY_BATCH)
+            try:
+                publish_batch(rows, current_ip(), replay_encoder)
+                queue.commit(len(rows))
+                print("Replayed", len(rows), "queued samples,", queue.pending(), "left")
+            except OSError as e:
+                print("Replay Failed:", e)
+                drop_link()
+                break
+            await asyncio.sleep_ms(config.REPLAY_INTERVAL_MS)
+
+def duty_cycle_publish():
+    # Publish wake: send the RTC buffer as one batch, answer any commands the
+    # broker queued for our persistent session, then deep-sleep again
+    global mqtt
+    buf = dutycycle.RtcBuffer(sensor_array.nvals)
+    mqtt = new_mqtt_client()
+    try:
+        mqtt_first_connect()
+        if buf.count:
+            publish_batch(buf.rows(), current_ip(), wire.Encoder(capacity=buf.capacity, nvals=sensor_array.nvals))
+            print("Pub duty batch:", buf.count, "samples")
+            buf.clear()
+            buf.save()
+        deadline = time.ticks_add(time.ticks_ms(), config.DUTY_LISTEN_MS)
+        while time.ticks_diff(deadline, time.ticks_ms()) > 0:
+            mqtt.check_msg()
+            time.sleep_ms(50)
+        mqtt.disconnect()
+    except Exception as e:
+        # Readings stay in RTC memory for the next publish wake
+        print("Duty Publish Failed:", e)
+    dutycycle.sleep()
+
+async def calibrate_task(cmd_id=None):
+    # Welford mean of fresh-air R0 estimates; hot-swaps R0 when converged
+    global calibrating
+    sensor = sensor_array.primary
+    cal = calibration.Calibrator(sensor.r0_from_raw, config.CAL_MIN_SAMPLES, config.CAL_MAX_SAMPLES,
+                                 config.CAL_REL_TOL)
+    while not cal.done():
+        try:
+            cal.add(sensor.adc.read())
+        except Exception:
+            cal.skipped += 1
+        await asyncio.sleep_ms(config.CAL_INTERVAL_MS)
+
+    res = {"cmd": "recalibrate", "n": cal.n, "skipped": cal.skipped}
+    if cmd_id is not None:
+        res["id"] = cmd_id
+    if cal.converged():
+        sensor.r0 = cal.mean
+        calibration.save_r0(sensor.r0)
+        if getattr(sensor, "use_table", False):
+            mq135_math.build_table(sensor.r0)
+        res["status"] = "ok"
+        print("Calibration Complete! R0:", sensor.r0, "from", cal.n, "readings")
+    else:
+        res["status"] = "error: readings did not settle"
+        print("Calibration Failed: keeping R0", sensor.r0)
+    res["r0"] = sensor.r0
+    res["sd"] = math.sqrt(cal.variance())
+    calibrating = False
+    if mqtt_connected:
+        try:
+            mqtt.publish(res_topic, json.dumps(res))
+        except OSError as e:
+            print("Calibration Publish Failed:", e)
+            drop_link()
+
+async def run(r0_val):
+    global link_up, link_down, reschedule
+    sensor_array.primary.r0 = r0_val
+    # Batching mode: samples collect in a preallocated ring buffer
+    samples = telemetry.SampleBuffer(config.MAX_BATCH_SIZE, settings.get("publish_ms"), sensor_array.nvals,
+                                     settings.get("batch"))
+    if samples.size > 1:
+        print("Batching", samples.size, "samples per publish")
+    sample_ready = asyncio.Event()
+    link_up = asyncio.Event()
+    link_down = asyncio.Event()
+    reschedule = asyncio.Event()
+    queue = flashq.FlashQueue(config.QUEUE_DIR, config.QUEUE_SEGMENT_RECORDS, config.QUEUE_MAX_SEGMENTS,
+                              sensor_array.nvals)
+    if queue.pending():
+        print("Flash backlog:", queue.pending(), "samples")
+        link_up.set()
+
+    tasks = [mqtt_task(), sensor_task(samples, sample_ready),
+             publish_task(samples, sample_ready, queue), replay_task(queue), diag_task()]
+    if discovery_service:
+        tasks.append(discovery_task())
+    if config.WIFI_RSSI_INTERVAL_MS:
+        tasks.append(wifi_task())
+    await asyncio.gather(*tasks)
 
 def main():
     global mqtt, discovery_service
@@ -147,6 +668,11 @@ def main():
         print(f"Found Config for {ssid}")
         connected = wm.connect(ssid, password)
     
+    if not connected and config.DUTY_CYCLE and machine.reset_cause() == machine.DEEPSLEEP_RESET:
+        # On battery: retry at the next publish wake instead of provisioning
+        print("WiFi Failed. Sleeping until the next publish wake.")
+        dutycycle.sleep()
+
     # 2. If Failed -> Provisioning Mode
     if not connected:
         print("WiFi Connection Failed or Config Missing.")
@@ -155,9 +681,28 @@ def main():
 
 
 
+    if config.DUTY_CYCLE:
+        duty_cycle_publish()
+        return
+
+    if config.WIFI_POWERSAVE:
+        # Modem sleep: the radio dozes between beacons while the scheduler
+        # idles; incoming MQTT/discovery packets still wake the tasks
+        try:
+            wm.sta_if.config(pm=wm.sta_if.PM_POWERSAVE)
+        except Exception as e:
+            print("WiFi power save unavailable:", e)
+
     # 3. Initialize Discovery
     try:
-        discovery_service = Discovery()
+        discovery_service = Discovery(
+            version=CURRENT_VERSION,
+            caps=["json", "binary"] + commands.names(),
+            get_ip=current_ip,
+            max_delay_ms=config.DISCOVERY_MAX_DELAY_MS,
+            rate=config.DISCOVERY_RATE,
+            burst=config.DISCOVERY_BURST
+        )
         print("Discovery Service Started on UDP 6666")
     except Exception as e:
         print("Discovery Init Failed:", e)
@@ -165,97 +710,24 @@ def main():
     # 4. MQTT Connection
     print("WiFi Connected. Connecting to RabbitMQ...")
     try:
-        mqtt = MQTTClient(
-            client_id=device_id,
-            server=config.MQTT_BROKER,
-            port=config.MQTT_PORT,
-            user=config.MQTT_USER,
-            password=config.MQTT_PASS,
-            keepalive=60
-        )
-        mqtt.set_callback(mqtt_callback)
-        mqtt.connect()
-        print("MQTT Connected!")
-        
-        # Subscribe
-        cmd_topic = f"chokepoint/devices/{device_id}/cmd"
-        mqtt.subscribe(cmd_topic)
-        
-        # Load R0 Calibration if it exists
-        r0_val = 76.63 # Default
+        mqtt = new_mqtt_client()
         try:
-            with open("r0_value.txt", "r") as f:
-                r0_val = float(f.read().strip())
-            print("Loaded R0:", r0_val)
-        except:
-            print("Using default R0")
-
+            mqtt_first_connect()
+            print("MQTT Connected!")
+        except Exception as e:
+            # Keep sampling to flash; mqtt_task retries with backoff
+            print("MQTT Connect Failed:", e)
         
         # Load R0 Calibration if it exists
-        r0_val = 76.63 # Default
-        try:
-            with open("r0_value.txt", "r") as f:
-                r0_val = float(f.read().strip())
-            print("Loaded R0:", r0_val)
-        except:
-            print("Using default R0")
-
-        # Main Loop
-        last_sensor_read = 0
-        while True:
-            try:
-                # Fast checks
-                mqtt.check_msg()
-                if discovery_service:
-                    discovery_service.check()
-                
-                # Periodic Sensor Read (every 2s)
-                now = time.time()
-                if now - last_sensor_read >= 2:
-                    last_sensor_read = now
-                    
-                    # Read Real Sensor securely
-                    raw_gas = -1
-                    co2_ppm = -1
-                    sensor_error = None
-                    
-                    try:
-                        raw_gas = mq.read()
-                        if raw_gas <= 0 or raw_gas >= 4095:
-                            sensor_error = "Hardware Fault: Invalid Voltage"
-                        else:
-                            co2_ppm = mq135_math.get_ppm(raw_gas, r0_val)
-                    except Exception as e:
-                        sensor_error = str(e)
-                        
-                    local_ip = wm.sta_if.ifconfig()[0] if wm.sta_if.isconnected() else "Unknown"
-
-                    data = {
-                        "device_id": device_id,
-                        "timestamp": int(now),
-                        "gas_raw": raw_gas,
-                        "co2": co2_ppm,
-                        "smoke": 0.0,
-                        "nh3": 0.0,
-                        "local_ip": local_ip,
-                        "error": sensor_error
-                    }
-                    
-                    # Publish
-                    payload = json.dumps(data)
-                    topic = f"chokepoint/devices/{device_id}/data"
-                    mqtt.publish(topic, payload)
-                    print("Pub:", payload)
-                
-                time.sleep(0.1) # Responsive loop
-                
-            except OSError as e:
-                print("MQTT Error:", e)
-                try: 
-                    mqtt.connect() 
-                    mqtt.subscribe(cmd_topic)
-                except: 
-                    time.sleep(5)
+        r0_val = calibration.load_r0()
+        print("Loaded R0:", r0_val)
+        if config.PPM_TABLE and hasattr(sensor_array.primary, "use_table"):
+            # Table lookups for the primary MQ-135's co2 curve
+            sensor_array.primary.use_table = True
+            mq135_math.build_table(r0_val)
+
+        # 5. Cooperative tasks: MQTT receive, discovery, sampling, publishing
+        asyncio.run(run(r0_val))
                     
     except Exception as e:
         print("Fatal Error:", e)
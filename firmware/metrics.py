@@ -0,0 +1,91 @@
+import time
+import gc
+from array import array
+
+# Per-stage latency histograms. Bucket b counts durations of b significant
+# bits, i.e. [2^(b-1), 2^b) microseconds; the last bucket is open-ended
+# (>= ~4 s). Everything is preallocated so recording never allocates.
+BUCKETS = 24
+
+CHECK_MSG = 0
+DISCOVERY = 1
+ADC_READ = 2
+ENCODE = 3
+PUBLISH = 4
+CONNECT = 5
+STAGES = ["check_msg", "discovery", "adc_read", "encode", "publish", "connect"]
+
+_mem_free = getattr(gc, "mem_free", lambda: 0)
+
+class Metrics:
+    def __init__(self):
+        n = len(STAGES)
+        self.hist = [array('L', [0] * BUCKETS) for _ in range(n)]
+        self.count = array('L', [0] * n)
+        self.total_us = array('L', [0] * n)
+        self.max_us = array('L', [0] * n)
+        self.overruns = 0   # Sample periods missed entirely, since reset()
+        self.reconnects = 0 # Since boot
+        self.suppressed = 0 # Samples inside the deadband, since reset()
+        self.boot_s = time.time() # ticks_ms wraps within days
+
+    def record(self, stage, start_us):
+        # start_us from time.ticks_us() taken before the stage ran
+        us = time.ticks_diff(time.ticks_us(), start_us)
+        b = 0
+        d = us
+        while d and b < BUCKETS - 1:
+            d >>= 1
+            b += 1
+        self.hist[stage][b] += 1
+        self.count[stage] += 1
+        self.total_us[stage] = (self.total_us[stage] + us) & 0xFFFFFFFF
+        if us > self.max_us[stage]:
+            self.max_us[stage] = us
+
+    def reset(self):
+        for i in range(len(STAGES)):
+            h = self.hist[i]
+            for b in range(BUCKETS):
+                h[b] = 0
+            self.count[i] = 0
+            self.total_us[i] = 0
+            self.max_us[i] = 0
+        self.overruns = 0
+        self.suppressed = 0
+
+    def _percentile(self, stage, pct):
+        # Upper bound of the bucket holding the pct-th percentile
+        target = (self.count[stage] * pct + 99) // 100
+        seen = 0
+        for b in range(BUCKETS):
+            seen += self.hist[stage][b]
+            if seen >= target:
+                return 1 << b
+        return 1 << BUCKETS
+
+    def summary(self):
+        stages = {}
+        for i in range(len(STAGES)):
+            n = self.count[i]
+            if not n:
+                continue
+            h = list(self.hist[i])
+            while h and not h[-1]:
+                h.pop()
+            stages[STAGES[i]] = {
+                "n": n,
+                "avg_us": self.total_us[i] // n,
+                "max_us": self.max_us[i],
+                "p50_us": self._percentile(i, 50),
+                "p99_us": self._percentile(i, 99),
+                "hist": h
+            }
+        return {
+            "uptime_s": time.time() - self.boot_s,
+            "mem_free": _mem_free(),
+            "overruns": self.overruns,
+            "reconnects": self.reconnects,
+            "suppressed": self.suppressed,
+            "stages": stages
+        }
@@ -1,17 +1,34 @@
-import machine
-import time
-import random
+import math
+import sensors
+import mq135_math
 
-class MQ135:
-    def __init__(self, pin_adc):
-        self.adc = machine.ADC(machine.Pin(pin_adc))
-        self.adc.atten(machine.ADC.ATTN_11DB) # Full range: 3.3v
+@sensors.driver("mq135")
+class MQ135(sensors.MQSensor):
+    # Datasheet curve fits: a, b for ppm = a * (Rs/R0)^b, then the clamp.
+    # co2 matches mq135_math so table and formula agree.
+    CURVES = {
+        "co2": (mq135_math.CO2_A, mq135_math.CO2_B, 400.0, 10000.0),
+        "nh3": (102.2, -2.473, 0.0, 10000.0),
+        "co": (605.18, -3.937, 0.0, 10000.0),
+        "alcohol": (77.255, -3.18, 0.0, 10000.0),
+        "toluene": (44.947, -3.445, 0.0, 10000.0),
+        "acetone": (34.668, -3.369, 0.0, 10000.0),
+    }
+    DEFAULT_GASES = ["co2", "nh3"]
+    DEFAULT_R0 = mq135_math.DEFAULT_R0
+    FRESH_AIR_FACTOR = 3.6
 
-    def get_readings(self):
-        # Simulate real gas variation based on raw ADC
-        raw = self.adc.read()
-        # Fake formulas for demo
-        co2 = 400 + (raw / 10) + random.uniform(-10, 10)
-        nh3 = 5 + (raw / 500)
-        smoke = (raw / 100)
-        return {"co2": co2, "nh3": nh3, "smoke": smoke}
+    def __init__(self, pin, gases=None, r0=None):
+        super().__init__(pin, gases, r0)
+        # Set on the primary sensor when the ppm lookup table is enabled
+        self.use_table = False
+
+    def convert(self, raw, out, i):
+        ratio = self.rs(raw) / self.r0
+        for k in range(len(self.gases)):
+            if self.use_table and self.gases[k] == "co2":
+                out[i] = mq135_math.get_ppm(raw, self.r0)
+            else:
+                a, b, lo, hi = self.curves[k]
+                out[i] = max(lo, min(a * math.pow(ratio, b), hi))
+            i += 1
@@ -1,4 +1,5 @@
 import math
+from array import array
 
 # Default calibration if no R0 is stored
 DEFAULT_R0 = 76.63
@@ -9,24 +10,83 @@ DEFAULT_R0 = 76.63
 CO2_A = 110.47
 CO2_B = -2.862
 
-def get_ppm(raw_val, r0=DEFAULT_R0):
+ADC_CODES = 4096
+
+# Table mode: get_ppm(raw) for every 12-bit ADC code, built once per R0.
+# Stored at the interpreter's native float width ('f' on single-precision
+# ports like the ESP32, 'd' on CPython) so lookups match the formula exactly.
+_TYPECODE = 'f' if 1.0 + 2.0 ** -30 == 1.0 else 'd'
+_ITEMSIZE = 4 if _TYPECODE == 'f' else 8
+_table = None
+_table_r0 = None
+
+def _compute_ppm(raw_val, r0):
     if raw_val <= 0: return 400.0 # Baseline CO2
-    
+
     # 1. Convert Raw (0-4095) to Voltage (assuming 3.3V reference)
     v_out = raw_val * (3.3 / 4095)
-    
+
     # 2. Calculate Sensor Resistance (Rs)
     # Circuit: Vcc (5V) -> Sensor -> RL (1k) -> GND
     # Rs = ((Vcc/Vout) - 1) * RL
     if v_out >= 5.0 or v_out <= 0: return 400.0
-    
+
     rs = ((5.0 / v_out) - 1.0) * 1.0 # RL is usually 1.0k
-    
+
     # 3. Calculate Ratio (Rs/R0)
     ratio = rs / r0
-    
+
     # 4. Calculate PPM
     ppm = CO2_A * math.pow(ratio, CO2_B)
-    
+
     # Clamp to reasonable values
     return max(400.0, min(ppm, 10000.0))
+
+def build_table(r0=DEFAULT_R0):
+    # (Re)build the lookup table for r0. Reuses the existing buffer.
+    global _table, _table_r0
+    if _table is None:
+        _table = array(_TYPECODE, bytearray(ADC_CODES * _ITEMSIZE))
+    for code in range(ADC_CODES):
+        _table[code] = _compute_ppm(code, r0)
+    _table_r0 = r0
+    return _table
+
+def get_ppm(raw_val, r0=DEFAULT_R0):
+    # In table mode (after build_table) this is a single index lookup; a new
+    # r0 rebuilds the table first
+    if _table is not None and 0 <= raw_val < ADC_CODES:
+        if r0 != _table_r0:
+            build_table(r0)
+        return _table[raw_val]
+    return _compute_ppm(raw_val, r0)
+
+def _map_many(codes, n, table, out):
+    for i in range(n):
+        out[i] = table[codes[i]]
+
+try:
+    import micropython
+
+    @micropython.viper
+    def _map_many_viper(codes: ptr16, n: int, table: ptr32, out: ptr32):
+        # Copies raw 32-bit floats word by word: no float objects allocated
+        for i in range(n):
+            out[i] = table[codes[i] & 0xFFF]
+except ImportError:
+    _map_many_viper = None
+
+def get_ppm_many(buffer, out, n=None):
+    # Convert a buffer of ADC codes (array('H')) into out, an array of the
+    # table's typecode ('f' on the ESP32), using the current table.
+    # Call build_table() first.
+    if _table is None:
+        raise ValueError("lookup table not built")
+    if n is None:
+        n = len(buffer)
+    if _map_many_viper and _TYPECODE == 'f':
+        _map_many_viper(buffer, n, _table, out)
+    else:
+        _map_many(buffer, n, _table, out)
+    return out
+
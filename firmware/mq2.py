@@ -0,0 +1,16 @@
+import sensors
+
+@sensors.driver("mq2")
+class MQ2(sensors.MQSensor):
+    # Sandbox Electronics log-log curves rewritten as ppm = a * (Rs/R0)^b,
+    # clamped to the sensor's 10000 ppm range.
+    # R0 depends on the part: calibrate in clean air and set "r0" in
+    # config.SENSORS.
+    CURVES = {
+        "smoke": (3195.5, -2.273, 0.0, 10000.0),
+        "lpg": (558.2, -2.128, 0.0, 10000.0),
+        "co": (26160.6, -2.941, 0.0, 10000.0),
+    }
+    DEFAULT_GASES = ["smoke"]
+    RLOAD = 5.0
+    FRESH_AIR_FACTOR = 9.83
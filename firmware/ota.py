@@ -3,30 +3,225 @@ import urequests
 import os
 import machine
 import time
+import hashlib
+import ubinascii
+import json
+import errno
+
+CHUNK_SIZE = 1024
+
+# Manifest updates: files are staged as <name>.new, then swapped together.
+# The pending journal makes the swap resumable if power fails midway.
+INDEX_FILE = "ota_index.json"
+PENDING_FILE = "ota_pending.json"
+STAGED_SUFFIX = ".new"
+
+def get_header(r, name):
+    # urequests keeps header names as sent; compare case-insensitively
+    headers = getattr(r, "headers", None) or {}
+    name = name.lower()
+    for key in headers:
+        if key.lower() == name:
+            return headers[key]
+    return None
+
+def _load_json(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except:
+        return None
+
+def _save_json(path, data):
+    with open(path + ".tmp", 'w') as f:
+        json.dump(data, f)
+    os.rename(path + ".tmp", path)
+
+def apply_pending():
+    # Finish an interrupted swap. Safe to call on every boot. Returns True
+    # once every staged file is in place; files that could not be renamed
+    # stay in the journal for the next boot and keep their old index entry.
+    pending = _load_json(PENDING_FILE)
+    if not pending:
+        return False
+    print("OTA: Applying", len(pending["files"]), "staged files")
+    failed = []
+    for name in pending["files"]:
+        try:
+            os.rename(name + STAGED_SUFFIX, name)
+        except OSError as e:
+            if e.args[0] != errno.ENOENT: # ENOENT: already moved before the interruption
+                print("OTA: Failed to swap in", name, e)
+                failed.append(name)
+    if not failed:
+        _save_json(INDEX_FILE, pending["index"])
+        os.remove(PENDING_FILE)
+        return True
+    old = _load_json(INDEX_FILE) or {"files": {}}
+    index = {"etag": old.get("etag"), "files": dict(pending["index"]["files"])}
+    for name in failed:
+        if name in old["files"]:
+            index["files"][name] = old["files"][name]
+        else:
+            index["files"].pop(name, None)
+    _save_json(INDEX_FILE, index)
+    _save_json(PENDING_FILE, {"files": failed, "index": pending["index"]})
+    return False
+
+def git_blob_hasher(size):
+    # GitHub's "sha" for a file is sha1("blob <size>\0" + content)
+    h = hashlib.sha1()
+    h.update(("blob %d\x00" % size).encode())
+    return h
 
 class OTAUpdater:
-    def __init__(self, main_dir='/'):
+    def __init__(self, main_dir='/', chunk_size=CHUNK_SIZE):
         self.main_dir = main_dir
+        # One reusable buffer: peak memory is the same for any image size
+        self.buf = bytearray(chunk_size)
+        self.mv = memoryview(self.buf)
 
-    def download_and_install(self, url, filename="main.py", headers=None):
+    def download_and_install(self, url, filename="main.py", headers=None, sha=None, hasher=None, size=None):
+        # Streams the body into filename + ".tmp", hashing as it arrives, and
+        # renames it over filename only once the digest matches `sha`.
+        # `hasher` defaults to sha256; pass git_blob_hasher(size) for GitHub shas.
         print("OTA: Downloading from", url)
+        tmp = filename + ".tmp"
+        response = None
         try:
             response = urequests.get(url, headers=headers)
-            if response.status_code == 200:
-                print("OTA: Download success. Writing to", filename)
-                with open(filename, 'w') as f:
-                    f.write(response.text)
-                print("OTA: Update Complete.")
-                response.close()
-                return True
-            else:
+            if response.status_code != 200:
                 print("OTA: Failed. Status Code:", response.status_code)
-                response.close()
                 return False
+
+            h = hasher or hashlib.sha256()
+            total = 0
+            with open(tmp, 'wb') as f:
+                while True:
+                    n = response.raw.readinto(self.buf)
+                    if not n:
+                        break
+                    chunk = self.mv[:n]
+                    h.update(chunk)
+                    f.write(chunk)
+                    total += n
+
+            digest = ubinascii.hexlify(h.digest()).decode()
+            if size is not None and total != size:
+                print("OTA: Size mismatch. Expected", size, "got", total)
+                os.remove(tmp)
+                return False
+            if sha and digest != sha:
+                print("OTA: Hash mismatch. Expected", sha, "got", digest)
+                os.remove(tmp)
+                return False
+
+            os.rename(tmp, filename)
+            print("OTA: Update Complete.", total, "bytes written to", filename)
+            return True
         except Exception as e:
             print("OTA: Error", e)
+            try: os.remove(tmp)
+            except: pass
             return False
+        finally:
+            if response:
+                response.close()
+
+    def simple_update(self, url, headers=None, sha=None, size=None):
+        # Update main.py by default, verified against GitHub's blob sha if given
+        hasher = git_blob_hasher(size) if sha and size is not None else None
+        return self.download_and_install(url, "main.py", headers=headers, sha=sha if hasher else None, hasher=hasher)
+
+    def file_sha256(self, path):
+        h = hashlib.sha256()
+        try:
+            with open(path, 'rb') as f:
+                while True:
+                    n = f.readinto(self.buf)
+                    if not n:
+                        break
+                    h.update(self.mv[:n])
+        except OSError:
+            return None
+        return ubinascii.hexlify(h.digest()).decode()
+
+    def load_index(self, manifest=None):
+        # {"etag": ETag of the last applied manifest, "files": {name: sha256}}
+        index = _load_json(INDEX_FILE)
+        if index is None:
+            # First manifest update: hash what is already on flash so only
+            # genuinely different files are downloaded
+            index = {"etag": None, "files": {}}
+            for name in (manifest or {}).get("files", {}):
+                sha = self.file_sha256(name)
+                if sha:
+                    index["files"][name] = sha
+        return index
+
+    def update_from_manifest(self, manifest, base_url, headers=None, etag=None):
+        # Downloads only files whose hash differs from the local index, stages
+        # them all, then swaps them in together. Returns the number of files
+        # replaced, or -1 if anything failed (nothing is swapped in if a
+        # download failed; a failed swap is retried by apply_pending).
+        files = manifest.get("files", {})
+        index = self.load_index(manifest)
+        changed = [name for name in files if index["files"].get(name) != files[name]["sha256"]]
+        new_index = {"etag": etag, "files": {}}
+        for name in files:
+            new_index["files"][name] = files[name]["sha256"]
+
+        if not changed:
+            _save_json(INDEX_FILE, new_index)
+            print("OTA: All", len(files), "files up to date.")
+            return 0
+
+        print("OTA:", len(changed), "of", len(files), "files changed:", changed)
+        for name in changed:
+            meta = files[name]
+            if not self.download_and_install(base_url + name, name + STAGED_SUFFIX, headers=headers,
+                                             sha=meta["sha256"], size=meta.get("size")):
+                for staged in changed:
+                    try: os.remove(staged + STAGED_SUFFIX)
+                    except: pass
+                return -1
+
+        _save_json(PENDING_FILE, {"files": changed, "index": new_index})
+        if not apply_pending():
+            return -1
+        return len(changed)
+
+def github_update(owner, repo, pat, manifest_path):
+    # Manifest-driven update from the GitHub contents API. The manifest fetch
+    # is conditional on the ETag of the last applied manifest.
+    # Returns files replaced, -1 on failure, None if the repo has no manifest.
+    base = "https://api.github.com/repos/%s/%s/contents/" % (owner, repo)
+    headers = {
+        "User-Agent": "ESP32-Chokepoint",
+        "Authorization": "Bearer " + pat,
+        "Accept": "application/vnd.github.v3.raw"
+    }
+    updater = OTAUpdater()
+    index = _load_json(INDEX_FILE) or {}
+    request_headers = dict(headers)
+    if index.get("etag"):
+        request_headers["If-None-Match"] = index["etag"]
+
+    r = urequests.get(base + manifest_path, headers=request_headers)
+    try:
+        if r.status_code == 304:
+            print("OTA: Manifest unchanged (304).")
+            return 0
+        if r.status_code == 404:
+            print("OTA: No manifest at", manifest_path)
+            return None
+        if r.status_code != 200:
+            print("OTA: Manifest fetch failed. Status:", r.status_code)
+            return -1
+        etag = get_header(r, "ETag")
+        manifest = r.json()
+    finally:
+        r.close()
 
-    def simple_update(self, url, headers=None):
-        # Update main.py by default
-        return self.download_and_install(url, "main.py", headers=headers)
+    file_dir = manifest_path.rsplit("/", 1)[0] + "/" if "/" in manifest_path else ""
+    return updater.update_from_manifest(manifest, base + file_dir, headers, etag)
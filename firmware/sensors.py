@@ -0,0 +1,105 @@
+import machine
+import math
+import wire
+
+# Sensor driver registry. config.SENSORS lists the sensors to sample, e.g.
+#   [{"driver": "mq135", "pin": 34, "gases": ["co2", "nh3"]}]
+# Each driver lives in a module of the same name (mq135.py, mq2.py) that
+# registers its class with @sensors.driver, and is only imported when used.
+# The first sensor is the primary one: it supplies gas_raw and is the one
+# that recalibration updates.
+_drivers = {}
+
+def driver(name):
+    def register(cls):
+        _drivers[name] = cls
+        return cls
+    return register
+
+class MQSensor:
+    # Metal-oxide sensor on an ADC pin: Vcc -> sensor -> RL -> GND, with the
+    # ADC across RL. One ADC read and one Rs/R0 per sample feed every gas:
+    # ppm = a * (Rs/R0)^b clamped to [lo, hi], with (a, b, lo, hi) from CURVES.
+    CURVES = {}
+    DEFAULT_GASES = []
+    DEFAULT_R0 = 10.0
+    RLOAD = 1.0 # kOhm
+    VCC = 5.0
+    FRESH_AIR_FACTOR = 1.0 # Rs/R0 in clean air, for calibration
+
+    def __init__(self, pin, gases=None, r0=None):
+        self.adc = machine.ADC(machine.Pin(pin))
+        self.adc.atten(machine.ADC.ATTN_11DB) # Read full 3.3V range
+        self.gases = gases or self.DEFAULT_GASES
+        for gas in self.gases:
+            if gas not in self.CURVES:
+                raise ValueError("%s has no %s curve" % (type(self).__name__, gas))
+        self.curves = [self.CURVES[gas] for gas in self.gases]
+        self.r0 = r0 or self.DEFAULT_R0
+
+    def rs(self, raw):
+        v_out = raw * (3.3 / 4095)
+        return ((self.VCC / v_out) - 1.0) * self.RLOAD
+
+    def r0_from_raw(self, raw):
+        # R0 estimate for one fresh-air reading, or None if it is noise
+        if raw * (3.3 / 4095) <= 0.1:
+            return None
+        return self.rs(raw) / self.FRESH_AIR_FACTOR
+
+    def convert(self, raw, out, i):
+        ratio = self.rs(raw) / self.r0
+        for a, b, lo, hi in self.curves:
+            out[i] = max(lo, min(a * math.pow(ratio, b), hi))
+            i += 1
+
+    def read(self, out, i):
+        # Writes len(gases) values into out[i:]; returns (raw, error)
+        try:
+            raw = self.adc.read()
+        except Exception as e:
+            self.fill(out, i)
+            return -1, str(e)
+        if raw <= 0 or raw >= 4095:
+            self.fill(out, i)
+            return raw, wire.ERRORS[wire.ERR_INVALID_VOLTAGE]
+        self.convert(raw, out, i)
+        return raw, None
+
+    def fill(self, out, i):
+        for _ in self.gases:
+            out[i] = -1
+            i += 1
+
+class SensorArray:
+    # All configured sensors, sampled in one pass per acquisition.
+    # `fields` names the values read() writes, in order.
+    def __init__(self, specs):
+        self.sensors = []
+        self.fields = []
+        for spec in specs:
+            name = spec["driver"]
+            if name not in _drivers:
+                __import__(name)
+            if name not in _drivers:
+                raise ValueError("unknown sensor driver " + name)
+            sensor = _drivers[name](spec["pin"], spec.get("gases"), spec.get("r0"))
+            self.sensors.append(sensor)
+            self.fields.extend(sensor.gases)
+        self.primary = self.sensors[0]
+        self.nvals = len(self.fields)
+
+    def read(self, out):
+        # Fill out (nvals floats); returns the primary's raw code and the
+        # first error any sensor reported
+        raw = None
+        error = None
+        i = 0
+        for sensor in self.sensors:
+            r, err = sensor.read(out, i)
+            if raw is None:
+                raw = r
+            if error is None:
+                error = err
+            i += len(sensor.gases)
+        return raw, error
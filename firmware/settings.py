@@ -0,0 +1,57 @@
+import json
+
+class Settings:
+    # Per-device runtime options persisted on flash. Defaults come from
+    # config.py; only keys listed in `defaults` can be changed remotely.
+    # `minimums` and `maximums` bound the accepted values of numeric keys;
+    # `choices` lists the accepted values of the others.
+    def __init__(self, defaults, path="settings.json", minimums=None, maximums=None, choices=None):
+        self.path = path
+        self.defaults = defaults
+        self.minimums = minimums or {}
+        self.maximums = maximums or {}
+        self.choices = choices or {}
+        self.values = dict(defaults)
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                stored = json.load(f)
+            for key in stored:
+                if key in self.defaults and (key not in self.choices or stored[key] in self.choices[key]):
+                    self.values[key] = stored[key]
+        except:
+            pass
+
+    def save(self):
+        try:
+            with open(self.path, 'w') as f:
+                json.dump(self.values, f)
+            return True
+        except:
+            return False
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value):
+        if key not in self.defaults:
+            return "error: unknown setting " + str(key)
+        if isinstance(value, bool) != isinstance(self.defaults[key], bool):
+            return "error: bad value for " + key # bool is an int subclass
+        if type(value) != type(self.defaults[key]):
+            # JSON numbers arrive as int or float; accept either for numeric keys
+            if not (isinstance(value, (int, float)) and isinstance(self.defaults[key], (int, float))):
+                return "error: bad value for " + key
+            value = type(self.defaults[key])(value)
+        if key in self.minimums and value < self.minimums[key]:
+            return "error: " + key + " below " + str(self.minimums[key])
+        if key in self.maximums and value > self.maximums[key]:
+            return "error: " + key + " above " + str(self.maximums[key])
+        if key in self.choices and value not in self.choices[key]:
+            return "error: " + key + " must be one of " + ", ".join(str(c) for c in self.choices[key])
+        if self.values.get(key) == value:
+            return "ok" # Spare the flash; retained config is redelivered often
+        self.values[key] = value
+        return "ok" if self.save() else "error: save failed"
@@ -0,0 +1,207 @@
+import time
+import json
+from array import array
+
+# Legacy gas keys the app expects in every JSON reading; sent as 0.0 when
+# no configured sensor measures them
+LEGACY_GASES = ["co2", "smoke", "nh3"]
+
+def batch_fields(fields):
+    # Column order of each row in a batched payload
+    return ["timestamp", "gas_raw"] + fields + ["error"]
+
+class SampleBuffer:
+    # Ring buffer of sensor samples, allocated once at startup for up to
+    # `capacity` samples. `size` is the batch size in use and can change at
+    # runtime up to capacity. When size samples are held, new samples
+    # overwrite the oldest so a failed publish never grows the heap. Each
+    # sample holds nvals gas values; slot i's values are
+    # vals[i * nvals:(i + 1) * nvals].
+    def __init__(self, capacity, max_delay_ms, nvals=1, size=None):
+        self.capacity = capacity
+        self.size = capacity if size is None else size
+        self.max_delay_ms = max_delay_ms
+        self.nvals = nvals
+        self.timestamps = array('L', [0] * capacity)
+        self.raw = array('h', [0] * capacity)
+        self.vals = array('f', [0.0] * (capacity * nvals))
+        self.errors = [None] * capacity
+        self.head = 0   # Next slot to write
+        self.count = 0
+        self.first_ms = 0
+
+    def append(self, timestamp, raw, vals, error=None):
+        if self.count == 0:
+            self.first_ms = time.ticks_ms()
+        i = self.head
+        self.timestamps[i] = timestamp
+        self.raw[i] = raw
+        off = i * self.nvals
+        for k in range(self.nvals):
+            self.vals[off + k] = vals[k]
+        self.errors[i] = error
+        self.head = (i + 1) % self.capacity
+        if self.count < self.size:
+            self.count += 1 # Otherwise the oldest sample drops out
+
+    def due(self):
+        # Batch is ready when full or when the oldest sample hit max latency
+        if self.count == 0:
+            return False
+        if self.count >= self.size:
+            return True
+        return time.ticks_diff(time.ticks_ms(), self.first_ms) >= self.max_delay_ms
+
+    def clear(self):
+        self.count = 0
+        for i in range(self.capacity):
+            self.errors[i] = None
+
+    def slot(self, n):
+        # Array index of the nth oldest sample
+        return (self.head - self.count + n) % self.capacity
+
+    def rows(self):
+        # Oldest first: [timestamp, gas_raw, *vals, error]
+        start = (self.head - self.count) % self.capacity
+        for n in range(self.count):
+            i = (start + n) % self.capacity
+            off = i * self.nvals
+            yield [self.timestamps[i], self.raw[i]] + list(self.vals[off:off + self.nvals]) + [self.errors[i]]
+
+class Deadband:
+    # Report by exception: a sample is kept only if the value (the primary
+    # gas) moved more than abs_ppm or rel (fraction) from the last kept
+    # value, the error state changed, or heartbeat_ms passed since the last
+    # kept sample. With both thresholds at 0 every sample is kept.
+    def __init__(self):
+        self.value = None
+        self.error = None
+        self.kept_ms = 0
+
+    def keep(self, value, error, abs_ppm, rel, heartbeat_ms):
+        now = time.ticks_ms()
+        keep = (self.value is None or error != self.error
+                or (not abs_ppm and not rel)
+                or time.ticks_diff(now, self.kept_ms) >= heartbeat_ms)
+        if not keep and error is None:
+            delta = abs(value - self.value)
+            keep = (abs_ppm > 0 and delta > abs_ppm) or (rel > 0 and delta > rel * abs(self.value))
+        if keep:
+            self.value = value
+            self.error = error
+            self.kept_ms = now
+        return keep
+
+def batch_json(device_id, local_ip, rows, fields, rssi=None):
+    return json.dumps({
+        "device_id": device_id,
+        "local_ip": local_ip,
+        "rssi": rssi,
+        "fields": batch_fields(fields),
+        "samples": list(rows)
+    })
+
+def batch_binary(encoder, rows):
+    encoder.reset()
+    for row in rows:
+        encoder.add_vals(row[0], row[1], row[-1], row, 2)
+    return encoder.frame()
+
+def reading_dict(device_id, local_ip, fields, timestamp, raw, vals, offset=0, error=None, rssi=None):
+    # Slow-path single reading, same keys as ReadingJson
+    data = {"device_id": device_id, "timestamp": timestamp, "gas_raw": raw}
+    for gas in LEGACY_GASES:
+        data[gas] = 0.0
+    for k in range(len(fields)):
+        data[fields[k]] = vals[offset + k]
+    data["local_ip"] = local_ip
+    data["rssi"] = rssi
+    data["error"] = error
+    return data
+
+def _put_number(buf, start, width, value, decimals=0):
+    # Right-align an integer (scaled by 10**decimals) in buf[start:start+width]
+    # with leading spaces. Returns False if it does not fit.
+    neg = value < 0
+    if neg:
+        value = -value
+    i = start + width - 1
+    digits = 0
+    while value or digits <= decimals:
+        if decimals and digits == decimals:
+            if i < start:
+                return False
+            buf[i] = 46 # '.'
+            i -= 1
+        if i < start:
+            return False
+        buf[i] = 48 + value % 10
+        value //= 10
+        digits += 1
+        i -= 1
+    if neg:
+        if i < start:
+            return False
+        buf[i] = 45 # '-'
+        i -= 1
+    while i >= start:
+        buf[i] = 32
+        i -= 1
+    return True
+
+class ReadingJson:
+    # Single-reading JSON payload in one preallocated buffer. Numbers are
+    # written in place into fixed-width slots padded with spaces (whitespace
+    # before a value is valid JSON), so steady-state publishes allocate no
+    # strings or dicts. The template is rebuilt only when the IP changes.
+    TS_WIDTH = 10
+    RAW_WIDTH = 5
+    VAL_WIDTH = 10 # Two decimals
+    RSSI_WIDTH = 4 # dBm, or null
+
+    def __init__(self, device_id, fields):
+        self.device_id = device_id
+        self.fields = fields
+        self.local_ip = None
+        self.buf = None
+        self.val_at = array('H', [0] * len(fields))
+
+    def set_ip(self, local_ip):
+        if local_ip == self.local_ip:
+            return
+        self.local_ip = local_ip
+        head = '{"device_id": %s, "timestamp": ' % json.dumps(self.device_id)
+        self.ts_at = len(head)
+        head += ' ' * self.TS_WIDTH + ', "gas_raw": '
+        self.raw_at = len(head)
+        head += ' ' * self.RAW_WIDTH
+        for gas in LEGACY_GASES:
+            if gas not in self.fields:
+                head += ', "%s": 0.0' % gas
+        for k in range(len(self.fields)):
+            head += ', %s: ' % json.dumps(self.fields[k])
+            self.val_at[k] = len(head)
+            head += ' ' * self.VAL_WIDTH
+        head += ', "local_ip": %s, "rssi": ' % json.dumps(local_ip)
+        self.rssi_at = len(head)
+        head += ' ' * self.RSSI_WIDTH + ', "error": null}'
+        self.buf = bytearray(head.encode())
+
+    def write(self, timestamp, raw, vals, offset=0, rssi=None):
+        # Returns the filled buffer, or None if a value does not fit its slot
+        buf = self.buf
+        if not (_put_number(buf, self.ts_at, self.TS_WIDTH, timestamp)
+                and _put_number(buf, self.raw_at, self.RAW_WIDTH, raw)):
+            return None
+        if rssi is None:
+            buf[self.rssi_at:self.rssi_at + 4] = b"null"
+        elif not _put_number(buf, self.rssi_at, self.RSSI_WIDTH, rssi):
+            return None
+        for k in range(len(self.val_at)):
+            v = vals[offset + k]
+            if not (-1e7 < v < 1e7):
+                return None
+            if not _put_number(buf, self.val_at[k], self.VAL_WIDTH, int(v * 100 + (0.5 if v >= 0 else -0.5)), 2):
+                return None
+        return buf
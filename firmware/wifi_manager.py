@@ -4,13 +4,128 @@ import ubinascii
 import machine
 import json
 import socket
+import select
 import gc
+import config
+
+# Provisioning server limits
+MAX_CLIENTS = 4
+CLIENT_TIMEOUT_MS = 3000
+RESET_GRACE_MS = 500
+MAX_REQUEST = 1024
+
+FORM_HTML = b"""<!DOCTYPE html>
+<html>
+<head>
+    <meta name="viewport" content="width=device-width, initial-scale=1">
+    <title>Chokepoint Setup</title>
+    <style>
+        body { font-family: sans-serif; background: #222; color: #fff; padding: 20px; text-align: center; }
+        input { padding: 10px; margin: 10px 0; width: 100%; box-sizing: border-box; }
+        button { padding: 10px; width: 100%; background: #0f0; color: #000; border: none; font-weight: bold; }
+    </style>
+</head>
+<body>
+    <h2>Setup WiFi</h2>
+    <p>Connect your Chokepoint device to WiFi</p>
+    <form action="/save" method="get">
+        <input name="ssid" placeholder="WiFi Name (SSID)" required>
+        <input name="password" type="password" placeholder="Password">
+        <button type="submit">SAVE & RESTART</button>
+    </form>
+</body>
+</html>
+"""
+
+SAVED_HTML = """<!DOCTYPE html><html>
+<head><meta name="viewport" content="width=device-width, initial-scale=1">
+<style>body{font-family:sans-serif;background:#222;color:#fff;text-align:center;padding:20px;}
+.id{background:#333;padding:10px;font-family:monospace;font-size:1.2em;border-radius:4px;margin:10px 0;user-select:all;}
+</style></head>
+<body>
+    <h1>Saved!</h1>
+    <p>Device ID:</p>
+    <div class="id">%s</div>
+    <p>Copy this ID to claim the device in the app.</p>
+    <p>Restarting...</p>
+</body></html>"""
+
+def _gzip(data):
+    # gzip-compressed copy of data, or None if this build cannot compress
+    try:
+        import deflate
+        import io
+        out = io.BytesIO()
+        with deflate.DeflateIO(out, deflate.GZIP) as f:
+            f.write(data)
+        return out.getvalue()
+    except:
+        pass
+    try:
+        import gzip
+        return gzip.compress(data)
+    except:
+        return None
+
+def _response(body):
+    # Pre-encoded (plain, gzip) HTTP responses for one page, built once
+    head = "HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nCache-Control: no-store\r\nConnection: close\r\nContent-Length: %d\r\n"
+    plain = (head % len(body)).encode() + b"\r\n" + body
+    gz = _gzip(body)
+    if gz is None or len(gz) >= len(body):
+        return plain, plain
+    return plain, (head % len(gz)).encode() + b"Content-Encoding: gzip\r\n\r\n" + gz
+
+class CaptiveDns:
+    # Answers every A query with the AP address so phones open the setup
+    # page as soon as they join the network
+    def __init__(self, ip, port=53):
+        self.ip = bytes(int(x) for x in ip.split("."))
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('0.0.0.0', port))
+        self.sock.setblocking(False)
+
+    def handle(self):
+        try:
+            data, addr = self.sock.recvfrom(512)
+        except:
+            return
+        # Standard query with exactly one question
+        if len(data) < 12 or data[2] & 0xF8 or data[4:6] != b"\x00\x01":
+            return
+        end = 12
+        while end < len(data) and data[end]:
+            end += data[end] + 1
+        end += 5 # Zero label, QTYPE, QCLASS
+        if end > len(data):
+            return
+        reply = (data[:2] + b"\x81\x80" + data[4:6] + b"\x00\x01\x00\x00\x00\x00"
+                 + data[12:end] + b"\xc0\x0c\x00\x01\x00\x01\x00\x00\x00\x3c\x00\x04" + self.ip)
+        try:
+            self.sock.sendto(reply, addr)
+        except Exception as e:
+            print("DNS Error:", e)
+
+    def close(self):
+        self.sock.close()
 
 class WifiManager:
     def __init__(self, config_file="wifi.json"):
         self.sta_if = network.WLAN(network.STA_IF)
         self.ap_if = network.WLAN(network.AP_IF)
         self.config_file = config_file
+        self.static_ip = False
+        # Link quality monitor (check_link)
+        self.ssid = None
+        self.password = None
+        self.bssid = None # hex, of the AP we associated with
+        self.channel = None
+        self.rssi = None # Last sample, dBm
+        self.rssi_avg = None
+        self.last_scan = None
+        self.scans = 0
+        self.roams = 0
 
     def get_device_id(self):
         return ubinascii.hexlify(machine.unique_id()).decode()
@@ -31,6 +146,54 @@ class WifiManager:
         except:
             return False
 
+    def load_link(self):
+        # Last good association, kept in the same file as the credentials:
+        # {"bssid": hex, "channel": n, "ifconfig": [ip, mask, gateway, dns],
+        #  "fast": joins on this lease since it came from DHCP}
+        try:
+            with open(self.config_file, 'r') as f:
+                return json.load(f).get("link")
+        except:
+            return None
+
+    def save_link(self, link):
+        try:
+            with open(self.config_file, 'r') as f:
+                data = json.load(f)
+            if data.get("link") == link:
+                return # Unchanged: spare the flash write
+            data["link"] = link
+            with open(self.config_file, 'w') as f:
+                json.dump(data, f)
+        except Exception as e:
+            print("Failed to save WiFi link:", e)
+
+    def forget_link(self):
+        try:
+            with open(self.config_file, 'r') as f:
+                data = json.load(f)
+            if data.pop("link", None) is not None:
+                with open(self.config_file, 'w') as f:
+                    json.dump(data, f)
+        except Exception as e:
+            print("Failed to forget WiFi link:", e)
+
+    def fast_joined(self):
+        # True if the current association runs on the cached lease (possibly
+        # joined by boot.py), which nothing has verified yet
+        link = self.load_link()
+        return self.static_ip or bool(link and link.get("fast"))
+
+    def renew_lease(self):
+        # The cached lease may be stale (address reassigned, new gateway or
+        # DNS): drop it and rejoin through a scan and DHCP
+        print('Renewing the cached lease with DHCP...')
+        self.forget_link()
+        ssid, password = self.ssid, self.password
+        if ssid is None:
+            ssid, password = self.load_config()
+        return bool(ssid) and self.connect(ssid, password)
+
     def reset_config(self):
         import os
         try:
@@ -63,131 +226,282 @@ class WifiManager:
         else:
             try: self.sta_if.disconnect() # Force clear error state
             except: pass
-            
-        self.sta_if.connect(ssid, password)
+
+        # Fast path: straight to the last AP with the last lease, no DHCP
+        self.ssid = ssid
+        self.password = password
+        self.rssi_avg = None
+        link = self.load_link() if config.WIFI_FAST_CONNECT else None
+        if link and link.get("fast", 0) >= config.WIFI_FAST_MAX_JOINS:
+            link = None # Take a real DHCP lease now and then
+        if link:
+            print('Connecting to', ssid, 'at', link["bssid"], 'ch', link["channel"], '...')
+            if self._associate(ssid, password, link, True, config.WIFI_FAST_TIMEOUT_MS):
+                self.bssid, self.channel = link["bssid"], link["channel"]
+                link["fast"] = link.get("fast", 0) + 1
+                self.save_link(link)
+                return True
+            print('Cached AP failed, scanning...')
+            try: self.sta_if.disconnect()
+            except: pass
+
+        ap = self._scan(ssid)
         print('Connecting to', ssid, '...')
-        for _ in range(20):
+        if not self._associate(ssid, password, ap, False, config.WIFI_CONNECT_TIMEOUT_MS):
+            return False
+        self._connected_to(ap)
+        return True
+
+    def _connected_to(self, ap):
+        # Remember the AP (and the lease) for the monitor and the fast path
+        if ap is None:
+            self.bssid = self.channel = None
+            return
+        self.bssid, self.channel = ap["bssid"], ap["channel"]
+        self.save_link({"bssid": ap["bssid"], "channel": ap["channel"],
+                        "ifconfig": list(self.sta_if.ifconfig())})
+
+    def check_link(self):
+        # Called periodically while connected: samples RSSI into a moving
+        # average and, while it stays below WIFI_ROAM_RSSI, scans at most
+        # every WIFI_ROAM_SCAN_INTERVAL_MS for a BSSID of the same SSID that
+        # is WIFI_ROAM_HYSTERESIS_DB stronger. Returns True after a roam.
+        try:
+            self.rssi = self.sta_if.status('rssi')
+        except:
+            self.rssi = None
+            return False
+        if self.rssi_avg is None:
+            self.rssi_avg = self.rssi
+        else:
+            self.rssi_avg += (self.rssi - self.rssi_avg) / 4
+        if self.rssi_avg >= config.WIFI_ROAM_RSSI:
+            return False
+        now = time.ticks_ms()
+        if self.last_scan is not None and time.ticks_diff(now, self.last_scan) < config.WIFI_ROAM_SCAN_INTERVAL_MS:
+            return False
+        self.last_scan = now
+
+        if self.ssid is None:
+            # Joined by boot.py: credentials and AP come from wifi.json
+            self.ssid, self.password = self.load_config()
+            link = self.load_link()
+            if link and self.bssid is None:
+                self.bssid, self.channel = link["bssid"], link["channel"]
+        if not self.ssid:
+            return False
+        self.scans += 1
+        ap = self._scan(self.ssid)
+        if ap is None or ap["bssid"] == self.bssid or ap["rssi"] < self.rssi_avg + config.WIFI_ROAM_HYSTERESIS_DB:
+            return False
+
+        print('Roaming from', self.bssid, self.rssi_avg, 'dBm to', ap["bssid"], ap["rssi"], 'dBm')
+        try: self.sta_if.disconnect()
+        except: pass
+        if self._associate(self.ssid, self.password, ap, False, config.WIFI_FAST_TIMEOUT_MS):
+            self._connected_to(ap)
+        elif not self.connect(self.ssid, self.password):
+            print('Roam failed, link down')
+            return True
+        self.roams += 1
+        self.rssi_avg = None
+        return True
+
+    def link_quality(self):
+        return {
+            "rssi": self.rssi,
+            "rssi_avg": None if self.rssi_avg is None else round(self.rssi_avg, 1),
+            "bssid": self.bssid,
+            "channel": self.channel,
+            "scans": self.scans,
+            "roams": self.roams
+        }
+
+    def _scan(self, ssid):
+        # Strongest AP advertising ssid, or None (hidden network, scan error)
+        best = None
+        try:
+            for name, bssid, channel, rssi, _, _ in self.sta_if.scan():
+                if name.decode() == ssid and (best is None or rssi > best[2]):
+                    best = (bssid, channel, rssi)
+        except Exception as e:
+            print("WiFi scan failed:", e)
+        if best is None:
+            return None
+        return {"bssid": ubinascii.hexlify(best[0]).decode(), "channel": best[1], "rssi": best[2]}
+
+    def _associate(self, ssid, password, link, static, timeout_ms):
+        try:
+            if static:
+                self.sta_if.ifconfig(tuple(link["ifconfig"]))
+                self.static_ip = True
+            elif self.static_ip:
+                self.sta_if.ifconfig('dhcp') # Undo the fast path's static config
+                self.static_ip = False
+        except:
+            pass
+        if link is None:
+            self.sta_if.connect(ssid, password)
+        else:
+            try: self.sta_if.config(channel=link["channel"]) # Channel hint, where supported
+            except: pass
+            self.sta_if.connect(ssid, password, bssid=ubinascii.unhexlify(link["bssid"]))
+
+        # Poll in ms steps; the fast path gives up as soon as the driver does
+        start = time.ticks_ms()
+        failed = (getattr(network, 'STAT_NO_AP_FOUND', None),
+                  getattr(network, 'STAT_WRONG_PASSWORD', None),
+                  getattr(network, 'STAT_CONNECT_FAIL', None))
+        while time.ticks_diff(time.ticks_ms(), start) < timeout_ms:
             if self.sta_if.isconnected():
-                print('Connected!', self.sta_if.ifconfig())
+                print('Connected in', time.ticks_diff(time.ticks_ms(), start), 'ms', self.sta_if.ifconfig())
                 return True
-            time.sleep(1)
+            if static and self.sta_if.status() in failed:
+                return False
+            time.sleep_ms(10)
         return False
 
+    def _parse_save(self, request_line):
+        # SSID and password from "GET /save?ssid=..&password=.. HTTP/1.1"
+        path = request_line.split(' ')[1]
+        query = path.split('?')[1]
+        params = {}
+        for pair in query.split('&'):
+            if '=' in pair:
+                k, v = pair.split('=', 1)
+                params[k] = v.replace('+', ' ').replace('%20', ' ')
+        return params.get('ssid', '').strip(), params.get('password', '').strip()
+
     def run_provisioning_server(self):
         self.start_ap()
         gc.collect() # Clean up memory for the server
-        
-        # Simple HTTP Server for Provisioning
+
+        # Responses are encoded once here, not per request
+        form = _response(FORM_HTML)
+        saved = _response((SAVED_HTML % self.get_device_id()).encode())
+
+        # Poll-driven HTTP Server for Provisioning: phones open several
+        # connections at once and must not wait on each other
         addr = socket.getaddrinfo('0.0.0.0', 80)[0][-1]
         s = socket.socket()
         s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1) # Allow port reuse
         s.bind(addr)
-        s.listen(1)
+        s.listen(MAX_CLIENTS)
+        s.setblocking(False)
+        poller = select.poll()
+        poller.register(s, select.POLLIN)
         print('Provisioning Server Listening on', addr)
 
+        dns = None
+        try:
+            dns = CaptiveDns(self.ap_if.ifconfig()[0])
+            poller.register(dns.sock, select.POLLIN)
+        except Exception as e:
+            print("Captive DNS unavailable:", e)
+
+        clients = {} # socket -> [request bytes, pending response, deadline]
+        saving = None # Client being sent the "saved" page; reset once it is closed
+        reset_at = None
         while True:
-            cl = None
             try:
-                cl, addr = s.accept()
-                cl.settimeout(3.0) # Avoid hanging
-                print('Client connected from', addr)
-                
-                cl_file = cl.makefile('rwb', 0)
-                
-                # Read Request Line
-                try:
-                    raw_req = cl_file.readline()
-                except Exception as e:
-                    print("Read Error:", e)
-                    cl.close()
-                    continue
-
-                if not raw_req:
-                    cl.close()
-                    continue
-                
-                request_line = raw_req.decode().strip()
-                
-                # Consume Headers (prevent blocking)
-                while True:
-                    try:
-                        line = cl_file.readline()
-                        if not line or line == b'\r\n' or line == b'\n':
-                            break
-                    except:
-                        break
-                
-                # Parsing Logic
-                if 'GET /save?' in request_line:
-                    try:
-                        path = request_line.split(' ')[1]
-                        query = path.split('?')[1]
-                        params = {}
-                        for pair in query.split('&'):
-                            if '=' in pair:
-                                k, v = pair.split('=', 1)
-                                params[k] = v.replace('+', ' ').replace('%20', ' ')
-                        
-                        ssid = params.get('ssid', '').strip()
-                        pwd = params.get('password', '').strip()
-                        
-                        if ssid:
-                            self.save_config(ssid, pwd)
-                            # Success Response with Device ID
-                            device_id = self.get_device_id()
-                            success_html = """HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n\r\n
-                            <!DOCTYPE html><html>
-                            <head><meta name="viewport" content="width=device-width, initial-scale=1">
-                            <style>body{font-family:sans-serif;background:#222;color:#fff;text-align:center;padding:20px;}
-                            .id{background:#333;padding:10px;font-family:monospace;font-size:1.2em;border-radius:4px;margin:10px 0;user-select:all;}
-                            </style></head>
-                            <body>
-                                <h1>Saved!</h1>
-                                <p>Device ID:</p>
-                                <div class="id">""" + device_id + """</div>
-                                <p>Copy this ID to claim the device in the app.</p>
-                                <p>Restarting...</p>
-                            </body></html>"""
-                            cl.send(success_html.encode())
-                            time.sleep(1)
-                            cl.close()
-                            time.sleep(2)
-                            machine.reset()
-                    except Exception as e:
-                        print("Provisioning Save Error", e)
-
-                # Serve Form
-                response = """HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nConnection: close\r\n\r\n
-                <!DOCTYPE html>
-                <html>
-                <head>
-                    <meta name="viewport" content="width=device-width, initial-scale=1">
-                    <title>Chokepoint Setup</title>
-                    <style>
-                        body { font-family: sans-serif; background: #222; color: #fff; padding: 20px; text-align: center; }
-                        input { padding: 10px; margin: 10px 0; width: 100%; box-sizing: border-box; }
-                        button { padding: 10px; width: 100%; background: #0f0; color: #000; border: none; font-weight: bold; }
-                    </style>
-                </head>
-                <body>
-                    <h2>Setup WiFi</h2>
-                    <p>Connect your Chokepoint device to WiFi</p>
-                    <form action="/save" method="get">
-                        <input name="ssid" placeholder="WiFi Name (SSID)" required>
-                        <input name="password" type="password" placeholder="Password">
-                        <button type="submit">SAVE & RESTART</button>
-                    </form>
-                </body>
-                </html>
-                """
-                cl.send(response.encode())
-                
+                for sock, ev in poller.poll(100 if reset_at else 250 if clients else 1000):
+                    if sock is s:
+                        self._accept(s, poller, clients)
+                    elif dns and sock is dns.sock:
+                        dns.handle()
+                    elif sock in clients:
+                        if ev & (select.POLLERR | select.POLLHUP):
+                            self._drop(sock, poller, clients)
+                        elif clients[sock][1] is None:
+                            if self._read(sock, clients[sock], form, saved):
+                                saving = sock
+                            if clients[sock][1] is not None:
+                                poller.modify(sock, select.POLLOUT)
+                        if sock in clients and clients[sock][1] is not None:
+                            self._write(sock, poller, clients)
+
+                now = time.ticks_ms()
+                for sock in list(clients):
+                    if time.ticks_diff(now, clients[sock][2]) > 0:
+                        self._drop(sock, poller, clients)
+                if saving is not None and saving not in clients:
+                    # Sent in full and closed (or timed out): leave the stack
+                    # a moment to get the tail and FIN out before the reset
+                    saving = None
+                    reset_at = time.ticks_add(now, RESET_GRACE_MS)
+                if reset_at is not None and time.ticks_diff(now, reset_at) > 0:
+                    machine.reset()
             except Exception as e:
                 print("Provisioning Loop Error:", e)
-            finally:
-                if cl:
-                    try: cl.close()
-                    except: pass
                 gc.collect()
 
+    def _accept(self, s, poller, clients):
+        try:
+            cl, addr = s.accept()
+        except:
+            return
+        if len(clients) >= MAX_CLIENTS:
+            # Oldest connection makes way; captive probes often linger
+            oldest = min(clients, key=lambda c: clients[c][2])
+            self._drop(oldest, poller, clients)
+        cl.setblocking(False)
+        poller.register(cl, select.POLLIN)
+        clients[cl] = [b"", None, time.ticks_add(time.ticks_ms(), CLIENT_TIMEOUT_MS)]
+        print('Client connected from', addr)
+
+    def _read(self, cl, state, form, saved):
+        # Collects the request head; sets the response once it is complete.
+        # Returns True when new credentials were saved.
+        try:
+            data = cl.recv(512)
+        except:
+            return False
+        if not data:
+            state[2] = time.ticks_ms() # Peer closed: drop on the next sweep
+            return False
+        state[0] += data
+        end = state[0].find(b"\r\n\r\n")
+        if end < 0:
+            if len(state[0]) > MAX_REQUEST:
+                state[2] = time.ticks_ms()
+            return False
+        head = state[0][:end].decode()
+        state[0] = b""
+        lines = head.split('\r\n')
+        request_line = lines[0]
+        gz = False
+        for line in lines[1:]:
+            line = line.lower()
+            if line.startswith('accept-encoding:') and 'gzip' in line:
+                gz = True
+        done = False
+        page = form
+        if 'GET /save?' in request_line:
+            try:
+                ssid, pwd = self._parse_save(request_line)
+                if ssid:
+                    self.save_config(ssid, pwd)
+                    page = saved
+                    done = True
+            except Exception as e:
+                print("Provisioning Save Error", e)
+        state[1] = memoryview(page[1] if gz else page[0])
+        return done
+
+    def _write(self, cl, poller, clients):
+        state = clients[cl]
+        try:
+            n = cl.send(state[1])
+        except:
+            n = 0
+        if n:
+            state[1] = state[1][n:]
+        if not len(state[1]):
+            self._drop(cl, poller, clients)
 
+    def _drop(self, cl, poller, clients):
+        try: poller.unregister(cl)
+        except: pass
+        try: cl.close()
+        except: pass
+        clients.pop(cl, None)
@@ -0,0 +1,129 @@
+# wire.py - Compact binary telemetry format (version 1)
+#
+# Runs on the device (encoding) and on CPython (decoding), so consumers can
+# import this file directly instead of re-implementing the layout.
+#
+# Frame:  header | body
+# Header: "<2sBBBB"  magic b"CP", version, kind, count, nvals          (6 B)
+# KIND_SAMPLES body: count records of "<IhB" + nvals * "f"
+#         timestamp (MicroPython epoch), gas_raw, error code, gas values
+# KIND_INFO body: u8 len + device_id, 4 B IPv4, u8 len + comma separated
+#         value names. Sent on connect and whenever the IP changes.
+import struct
+
+MAGIC = b"CP"
+VERSION = 1
+
+KIND_SAMPLES = 1
+KIND_INFO = 2
+
+HEADER_FMT = "<2sBBBB"
+HEADER_SIZE = struct.calcsize(HEADER_FMT)
+RECORD_FMT = "<IhB"
+RECORD_SIZE = struct.calcsize(RECORD_FMT)
+
+ERR_NONE = 0
+ERR_INVALID_VOLTAGE = 1
+ERR_READ = 2
+ERRORS = {
+    ERR_INVALID_VOLTAGE: "Hardware Fault: Invalid Voltage",
+    ERR_READ: "Sensor Read Error",
+}
+
+DEFAULT_FIELDS = ["co2"]
+
+def error_code(error):
+    if error is None:
+        return ERR_NONE
+    if error == ERRORS[ERR_INVALID_VOLTAGE]:
+        return ERR_INVALID_VOLTAGE
+    return ERR_READ
+
+class Encoder:
+    # Packs samples into one preallocated frame buffer with pack_into,
+    # so encoding does not build intermediate strings.
+    def __init__(self, capacity=1, nvals=1):
+        self.capacity = capacity
+        self.nvals = nvals
+        self.record_size = RECORD_SIZE + 4 * nvals
+        self.buf = bytearray(HEADER_SIZE + capacity * self.record_size)
+        self.mv = memoryview(self.buf)
+        self.count = 0
+
+    def reset(self):
+        self.count = 0
+
+    def add_vals(self, timestamp, raw, error, vals, offset=0):
+        # Appends one record, taking the nvals values from vals[offset:]
+        if self.count >= self.capacity:
+            return False
+        off = HEADER_SIZE + self.count * self.record_size
+        struct.pack_into(RECORD_FMT, self.buf, off, timestamp, raw, error_code(error))
+        off += RECORD_SIZE
+        for k in range(self.nvals):
+            struct.pack_into("<f", self.buf, off, vals[offset + k])
+            off += 4
+        self.count += 1
+        return True
+
+    def frame(self):
+        struct.pack_into(HEADER_FMT, self.buf, 0, MAGIC, VERSION, KIND_SAMPLES, self.count, self.nvals)
+        return self.mv[:HEADER_SIZE + self.count * self.record_size]
+
+def encode_info(device_id, local_ip, fields=DEFAULT_FIELDS):
+    dev = device_id.encode()
+    names = ",".join(fields).encode()
+    try:
+        ip = bytes([int(p) for p in local_ip.split(".")])
+        if len(ip) != 4:
+            raise ValueError
+    except ValueError:
+        ip = b"\x00\x00\x00\x00"
+    return (struct.pack(HEADER_FMT, MAGIC, VERSION, KIND_INFO, 1, len(fields))
+            + bytes([len(dev)]) + dev + ip + bytes([len(names)]) + names)
+
+def decode(frame, fields=None):
+    # Returns a dict shaped like the JSON payloads. Pass the value names from
+    # the device's last info frame as `fields` to label the gas values.
+    frame = bytes(frame)
+    magic, version, kind, count, nvals = struct.unpack_from(HEADER_FMT, frame, 0)
+    if magic != MAGIC:
+        raise ValueError("bad magic")
+    if version != VERSION:
+        raise ValueError("unsupported version %d" % version)
+    off = HEADER_SIZE
+
+    if kind == KIND_INFO:
+        n = frame[off]
+        device_id = frame[off + 1:off + 1 + n].decode()
+        off += 1 + n
+        local_ip = ".".join(str(b) for b in frame[off:off + 4])
+        off += 4
+        n = frame[off]
+        names = frame[off + 1:off + 1 + n].decode()
+        return {
+            "kind": "info",
+            "device_id": device_id,
+            "local_ip": local_ip,
+            "fields": names.split(",") if names else [],
+        }
+
+    if kind != KIND_SAMPLES:
+        raise ValueError("unknown kind %d" % kind)
+    names = fields or DEFAULT_FIELDS
+    vals_fmt = "<%df" % nvals
+    record_size = RECORD_SIZE + 4 * nvals
+    samples = []
+    for i in range(count):
+        rec = off + i * record_size
+        timestamp, raw, err = struct.unpack_from(RECORD_FMT, frame, rec)
+        vals = struct.unpack_from(vals_fmt, frame, rec + RECORD_SIZE)
+        sample = {
+            "timestamp": timestamp,
+            "gas_raw": raw,
+            "error": ERRORS.get(err, "Error %d" % err) if err else None,
+        }
+        for j in range(nvals):
+            sample[names[j] if j < len(names) else "val%d" % j] = vals[j]
+        samples.append(sample)
+    return {"kind": "samples", "samples": samples}
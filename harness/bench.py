@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""Microbenchmarks for the firmware's hot functions, with regression
+baselines. CPython only.
+
+    python3 harness/bench.py                 # run and compare to the baseline
+    python3 harness/bench.py --update        # record a new baseline
+    python3 harness/bench.py get_ppm --json  # only names containing "get_ppm"
+
+Each benchmark reports ops/sec and bytes allocated per call (the
+tracemalloc peak). Speed is compared as a score: the best ops/sec over
+ROUNDS rounds divided by the best ops/sec of a fixed reference loop timed
+in alternating rounds, so a baseline recorded on one machine still holds
+on another, and a round slowed by other work on the host does not count.
+Scores track relative changes to the firmware's code, not its speed on
+the ESP32; no MicroPython baseline has been recorded.
+
+The run exits 1 if any score drops more than --tolerance below its
+baseline in bench_baseline.json, if allocation grows by more than
+ALLOC_SLACK bytes per call, or if a benchmark has no baseline. A
+benchmark that looks regressed is measured once more before it is
+reported. --update records the median of UPDATE_RUNS measurements.
+"""
+import sys
+import time
+import json
+import gc
+import builtins
+import tracemalloc
+
+import device
+
+BASELINE_FILE = device.HERE + "/bench_baseline.json"
+ROUND_MS = 20
+ROUNDS = 60
+UPDATE_RUNS = 3
+ALLOC_CALLS = 200
+ALLOC_SLACK = 16
+_print = print
+
+
+def reference():
+    # Fixed integer loop: the yardstick scores are measured against
+    x = 0
+    for i in range(100):
+        x = (x * 31 + i) & 0xFFFF
+    return x
+
+
+def _calibrate(fn):
+    # Calls per round so one round takes about ROUND_MS, sized from a probe
+    # of at least half a round so timer and warm-up noise stay small
+    n = 1
+    while True:
+        elapsed = _run(fn, n)
+        if elapsed >= ROUND_MS * 500:
+            return max(1, n * ROUND_MS * 1000 // elapsed)
+        n *= 2
+
+
+def _run(fn, n):
+    t = time.ticks_us()
+    for _ in range(n):
+        fn()
+    return max(time.ticks_diff(time.ticks_us(), t), 1)
+
+
+def measure(fn):
+    # (ops/sec, score): rounds of fn alternate with rounds of the reference
+    # loop so both see the same machine conditions. Interference only ever
+    # slows a round down, so each side keeps its fastest round.
+    n = _calibrate(fn)
+    ref_n = _calibrate(reference)
+    best = 0
+    best_ref = 0
+    for _ in range(ROUNDS):
+        gc.collect()
+        best_ref = max(best_ref, ref_n * 1000000 / _run(reference, ref_n))
+        best = max(best, n * 1000000 / _run(fn, n))
+    return best, best / best_ref
+
+
+def alloc_per_call(fn):
+    fn() # Warm up caches and lazily built state
+    tracemalloc.start()
+    try:
+        peak = 0
+        for _ in range(ALLOC_CALLS // 10):
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            fn()
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - current)
+        return peak
+    finally:
+        tracemalloc.stop()
+
+
+# ---- Benchmarks: each setup returns the callable to time ----
+
+def bench_get_ppm():
+    import mq135_math
+    mq135_math._table = None
+    codes = [400 + (i * 37) % 3000 for i in range(64)]
+    state = [0]
+
+    def fn():
+        state[0] = (state[0] + 1) & 63
+        mq135_math.get_ppm(codes[state[0]])
+    return fn
+
+
+def bench_get_ppm_table():
+    import mq135_math
+    mq135_math.build_table(mq135_math.DEFAULT_R0)
+    codes = [400 + (i * 37) % 3000 for i in range(64)]
+    state = [0]
+
+    def fn():
+        state[0] = (state[0] + 1) & 63
+        mq135_math.get_ppm(codes[state[0]], mq135_math.DEFAULT_R0)
+    return fn
+
+
+def bench_sensor_read():
+    import config
+    import sensors
+    from array import array
+    sensor_array = sensors.SensorArray(config.SENSORS)
+    out = array('f', [0.0] * sensor_array.nvals)
+    return lambda: sensor_array.read(out)
+
+
+def _reading():
+    from array import array
+    return ["co2", "nh3"], array('f', [612.25, 3.5])
+
+
+def bench_reading_json():
+    # Preallocated single-reading payload (publish hot path)
+    import telemetry
+    fields, vals = _reading()
+    payload = telemetry.ReadingJson("010203040506", fields)
+    payload.set_ip("10.0.0.5")
+    return lambda: payload.write(1792291707, 1500, vals, 0, -61)
+
+
+def bench_reading_dumps():
+    # json.dumps of a reading dict (error and out-of-range slow path)
+    import telemetry
+    fields, vals = _reading()
+    return lambda: json.dumps(telemetry.reading_dict("010203040506", "10.0.0.5", fields,
+                                                     1792291707, 1500, vals, 0, None, -61))
+
+
+def bench_batch_json():
+    import telemetry
+    rows = [[1792291707 + i, 1500 + i, 612.25, 3.5, None] for i in range(10)]
+    return lambda: telemetry.batch_json("010203040506", "10.0.0.5", rows, ["co2", "nh3"], -61)
+
+
+def bench_batch_binary():
+    import telemetry
+    import wire
+    rows = [[1792291707 + i, 1500 + i, 612.25, 3.5, None] for i in range(10)]
+    encoder = wire.Encoder(capacity=10, nvals=2)
+    return lambda: telemetry.batch_binary(encoder, rows)
+
+
+def bench_discovery_check():
+    # One DISCOVER datagram for another device (silently dropped) per call
+    import socket
+    from discovery import Discovery
+    service = Discovery(port=16666, version="bench", caps=["json"])
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    addr = socket.getaddrinfo("127.0.0.1", 16666)[0][-1]
+    msg = b"DISCOVER:ffffffffffff"
+
+    def fn():
+        sender.sendto(msg, addr)
+        service.check()
+    return fn
+
+
+_main = []
+
+
+def _firmware_main():
+    # main.py imported once against a connected fake broker
+    if not _main:
+        import broker
+        import fake.umqtt.simple
+        import main
+        fake.umqtt.simple.BROKER = broker.Broker(keep_log=False)
+        main.mqtt = main.new_mqtt_client()
+        main.mqtt_connect()
+        _main.append(main)
+    return _main[0]
+
+
+def bench_dispatch_ping():
+    main = _firmware_main()
+    msg = b'{"cmd": "ping"}'
+    return lambda: main.mqtt_callback(main.cmd_topic, msg)
+
+
+def bench_dispatch_set():
+    # Unchanged value: dispatch, validation and the response, no flash write
+    main = _firmware_main()
+    msg = b'{"cmd": "set", "key": "heartbeat", "value": %d, "id": "b1"}' % main.settings.get("heartbeat")
+    return lambda: main.mqtt_callback(main.cmd_topic, msg)
+
+
+BENCHMARKS = [
+    ("get_ppm", bench_get_ppm),
+    ("get_ppm_table", bench_get_ppm_table),
+    ("sensor_read", bench_sensor_read),
+    ("reading_json", bench_reading_json),
+    ("reading_dumps", bench_reading_dumps),
+    ("batch_json", bench_batch_json),
+    ("batch_binary", bench_batch_binary),
+    ("discovery_check", bench_discovery_check),
+    ("dispatch_ping", bench_dispatch_ping),
+    ("dispatch_set", bench_dispatch_set),
+]
+
+
+def runtime():
+    return sys.implementation.name
+
+
+def load_baseline():
+    try:
+        with open(BASELINE_FILE) as f:
+            return json.load(f)
+    except OSError:
+        return {}
+
+
+def save_baseline(data):
+    with open(BASELINE_FILE, "w") as f:
+        f.write(json.dumps(data, indent=2, sort_keys=True))
+        f.write("\n")
+
+
+def compare(name, result, base, tolerance):
+    # Regression message, or None
+    if result["score"] < base["score"] * (1 - tolerance):
+        return "%s: score %.4f is %d%% below baseline %.4f" % (
+            name, result["score"], round(100 * (1 - result["score"] / base["score"])), base["score"])
+    if result["alloc"] > base["alloc"] + ALLOC_SLACK:
+        return "%s: allocates %d B/call, baseline %d B" % (name, result["alloc"], base["alloc"])
+    return None
+
+
+def run_benchmarks(selected):
+    results = {}
+    for name, setup in BENCHMARKS:
+        if name in selected:
+            fn = setup()
+            ops, score = measure(fn)
+            results[name] = {"ops_per_s": round(ops), "score": round(score, 4), "alloc": alloc_per_call(fn)}
+    return results
+
+
+def main(argv):
+    update = "--update" in argv
+    as_json = "--json" in argv
+    tolerance = 0.25
+    if "--tolerance" in argv:
+        tolerance = float(argv[argv.index("--tolerance") + 1])
+    names = [a for i, a in enumerate(argv) if not a.startswith("--") and not (i and argv[i - 1] == "--tolerance")]
+    if runtime() != "cpython":
+        _print("bench.py runs on CPython only; there is no %s baseline" % runtime())
+        return 2
+
+    device.install()
+    device.prepare_fs("/tmp/chokepoint-bench")
+    builtins.print = lambda *args, **kwargs: None # Firmware logging
+
+    ref = measure(reference)[0]
+    selected = [name for name, _ in BENCHMARKS if not names or any(n in name for n in names)]
+    results = run_benchmarks(selected)
+    if update:
+        # Median of several runs, so one lucky or unlucky run does not set the bar
+        runs = [results] + [run_benchmarks(selected) for _ in range(UPDATE_RUNS - 1)]
+        for name in selected:
+            scores = sorted(r[name]["score"] for r in runs)
+            results[name]["score"] = scores[len(scores) // 2]
+
+    all_base = load_baseline()
+    base = all_base.get(runtime(), {}).get("benchmarks", {})
+    missing = [name for name in results if name not in base]
+    suspects = [name for name in results if name in base and compare(name, results[name], base[name], tolerance)]
+    if suspects and not update:
+        # Confirm before reporting: keep the better of the two measurements
+        again = run_benchmarks(suspects)
+        for name in suspects:
+            if again[name]["score"] > results[name]["score"]:
+                results[name]["ops_per_s"] = again[name]["ops_per_s"]
+                results[name]["score"] = again[name]["score"]
+    failures = []
+    for name in suspects:
+        msg = compare(name, results[name], base[name], tolerance)
+        if msg:
+            failures.append(msg)
+
+    if as_json:
+        _print(json.dumps({"runtime": runtime(), "reference_ops_per_s": round(ref),
+                           "results": results, "regressions": failures, "no_baseline": missing}))
+    else:
+        _print("%s, reference loop %d ops/s" % (runtime(), ref))
+        _print("%-16s %12s %8s %9s %9s" % ("benchmark", "ops/s", "score", "baseline", "B/call"))
+        for name in results:
+            r = results[name]
+            b = base.get(name)
+            _print("%-16s %12d %8.4f %9s %9d" % (name, r["ops_per_s"], r["score"],
+                                                 "%.4f" % b["score"] if b else "-", r["alloc"]))
+        for msg in failures:
+            _print("REGRESSION " + msg)
+        if missing:
+            _print("NO BASELINE for %s in %s: %s" % (runtime(), BASELINE_FILE, ", ".join(missing)))
+
+    if update:
+        entry = all_base.setdefault(runtime(), {"benchmarks": {}})
+        for name in results:
+            entry["benchmarks"][name] = {"score": results[name]["score"], "alloc": results[name]["alloc"]}
+        save_baseline(all_base)
+        _print("Baseline updated:", BASELINE_FILE)
+        return 0
+    return 1 if failures or missing else 0
+
+
+if __name__ == "__main__":
+    code = main(sys.argv[1:])
+    import os
+    if hasattr(os, "_exit"):
+        sys.stdout.flush()
+        os._exit(code)
+    sys.exit(code)
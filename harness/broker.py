@@ -0,0 +1,133 @@
+"""In-process MQTT broker stand-in for the harness.
+
+Device-side clients (fake.umqtt) and the harness share one Broker. Every
+client gets a real socket pair; the broker writes one byte per delivered
+packet, so the firmware's "wait until mqtt.sock is readable" loop behaves
+as it does against a real broker. Supports persistent sessions, QoS 1
+queueing while offline, retained messages, PINGRESP and + / # filters.
+"""
+import time
+import _thread
+
+
+def topic_matches(pattern, topic):
+    p = pattern.split(b"/")
+    t = topic.split(b"/")
+    for i in range(len(p)):
+        if p[i] == b"#":
+            return True
+        if i >= len(t) or (p[i] != b"+" and p[i] != t[i]):
+            return False
+    return len(p) == len(t)
+
+
+def _b(s):
+    return s.encode() if isinstance(s, str) else bytes(s)
+
+
+class Session:
+    def __init__(self):
+        self.subs = {} # filter -> qos
+        self.queued = [] # (topic, msg) for QoS 1 subscriptions while offline
+        self.client = None
+
+
+class Broker:
+    def __init__(self, keep_log=True):
+        self.lock = _thread.allocate_lock()
+        self.keep_log = keep_log
+        self.sessions = {}
+        self.retained = {}
+        self.log = [] # (ticks_us, topic, msg) of everything published
+        self.counts = {}
+        self.refuse = False
+
+    # Device side (called by fake.umqtt)
+
+    def connect(self, client, clean_session):
+        if self.refuse:
+            raise OSError("connection refused")
+        with self.lock:
+            session = self.sessions.get(client.client_id)
+            present = session is not None and not clean_session
+            if not present:
+                session = Session()
+                self.sessions[client.client_id] = session
+            session.client = client
+            queued, session.queued = session.queued, []
+        for topic, msg in queued:
+            client.deliver(topic, msg)
+        return present
+
+    def disconnect(self, client):
+        with self.lock:
+            session = self.sessions.get(client.client_id)
+            if session and session.client is client:
+                session.client = None
+
+    def subscribe(self, client, pattern, qos):
+        pattern = _b(pattern)
+        with self.lock:
+            self.sessions[client.client_id].subs[pattern] = qos
+            retained = [(t, m) for t, m in self.retained.items() if topic_matches(pattern, t)]
+        for topic, msg in retained:
+            client.deliver(topic, msg)
+
+    def ping(self, client):
+        client.deliver(None, None)
+
+    # Either side
+
+    def publish(self, topic, msg, retain=False, qos=0):
+        topic = _b(topic)
+        msg = _b(msg)
+        with self.lock:
+            if self.keep_log:
+                self.log.append((time.ticks_us(), topic, msg))
+            self.counts[topic] = self.counts.get(topic, 0) + 1
+            if retain:
+                if msg:
+                    self.retained[topic] = msg
+                else:
+                    self.retained.pop(topic, None)
+            targets = []
+            for session in self.sessions.values():
+                for pattern, sub_qos in session.subs.items():
+                    if topic_matches(pattern, topic):
+                        if session.client is not None:
+                            targets.append(session.client)
+                        elif sub_qos and qos:
+                            session.queued.append((topic, msg))
+                        break
+        for client in targets:
+            client.deliver(topic, msg)
+
+    # Harness side
+
+    def drop(self, client_id):
+        # Cut the link as a network failure would
+        with self.lock:
+            session = self.sessions.get(client_id)
+            client = session.client if session else None
+            if session:
+                session.client = None
+        if client is not None:
+            client.kill()
+
+    def count(self, topic):
+        return self.counts.get(_b(topic), 0)
+
+    def wait_for(self, match, timeout_ms, start=0):
+        # First log entry from index `start` for which match(topic, msg) is
+        # true, as (index, ticks_us); None on timeout
+        deadline = time.ticks_add(time.ticks_ms(), timeout_ms)
+        i = start
+        while True:
+            while i < len(self.log):
+                at, topic, msg = self.log[i]
+                if match(topic, msg):
+                    return i, at
+                i += 1
+            if time.ticks_diff(deadline, time.ticks_ms()) <= 0:
+                return None
+            time.sleep_ms(1)
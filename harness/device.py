@@ -0,0 +1,128 @@
+"""Boot the unchanged firmware/ tree on the host.
+
+install() puts the fakes in sys.modules in place of the ESP32-only modules
+(machine, network, umqtt.simple, urequests), adds the MicroPython time and
+asyncio helpers CPython lacks, and puts firmware/ on sys.path. Device then
+runs main.main() on its own thread in a scratch directory that plays the
+part of the device filesystem.
+"""
+import sys
+import os
+import time
+import json
+import _thread
+
+HERE = __file__.rsplit("/", 1)[0] if "/" in __file__ else "."
+if not HERE.startswith("/"):
+    HERE = os.getcwd() + "/" + HERE # Absolute: the device fs becomes the cwd
+FIRMWARE_DIR = HERE + "/../firmware"
+
+
+def _install_time():
+    if hasattr(time, "ticks_ms"):
+        return # MicroPython
+    period = 1 << 30
+
+    def ticks_diff(a, b):
+        return ((a - b + period // 2) % period) - period // 2
+
+    time.ticks_ms = lambda: int(time.monotonic() * 1000) % period
+    time.ticks_us = lambda: int(time.monotonic() * 1000000) % period
+    time.ticks_add = lambda t, delta: (t + delta) % period
+    time.ticks_diff = ticks_diff
+    time.sleep_ms = lambda ms: time.sleep(ms / 1000)
+    time.sleep_us = lambda us: time.sleep(us / 1000000)
+
+    import asyncio
+    if not hasattr(asyncio, "sleep_ms"):
+        asyncio.sleep_ms = lambda ms: asyncio.sleep(ms / 1000)
+
+
+def install():
+    _install_time()
+    for name, real in (("ubinascii", "binascii"), ("ujson", "json")):
+        try:
+            __import__(name)
+        except ImportError:
+            sys.modules[name] = __import__(real)
+
+    sys.path.insert(0, HERE)
+    from fake import machine, network, urequests
+    import fake.umqtt
+    import fake.umqtt.simple
+    sys.modules["machine"] = machine
+    sys.modules["network"] = network
+    sys.modules["urequests"] = urequests
+    sys.modules["umqtt"] = fake.umqtt
+    sys.modules["umqtt.simple"] = fake.umqtt.simple
+    sys.path.insert(0, FIRMWARE_DIR)
+
+
+def _is_dir(path):
+    return os.stat(path)[0] & 0x4000
+
+
+def _rmtree(path):
+    for name in os.listdir(path):
+        full = path + "/" + name
+        if _is_dir(full):
+            _rmtree(full)
+            os.rmdir(full)
+        else:
+            os.remove(full)
+
+
+def prepare_fs(path):
+    # Fresh, empty device filesystem; returns its absolute path
+    try:
+        os.mkdir(path)
+    except OSError:
+        _rmtree(path)
+    os.chdir(path)
+    return os.getcwd()
+
+
+class Device:
+    def __init__(self, broker, overrides=None, ssid="harness", password="harness"):
+        self.broker = broker
+        self.overrides = overrides or {}
+        self.ssid = ssid
+        self.password = password
+        self.main = None
+        self.error = None
+        self.running = False
+
+    def boot(self):
+        # Provisioned device: credentials on flash, config.py overrides applied
+        # before main.py is imported
+        with open("wifi.json", "w") as f:
+            json.dump({"ssid": self.ssid, "password": self.password}, f)
+        import config
+        for key in self.overrides:
+            setattr(config, key, self.overrides[key])
+        sys.modules["umqtt.simple"].BROKER = self.broker
+        import main
+        self.main = main
+        self.running = True
+        _thread.start_new_thread(self._run, ())
+
+    def _run(self):
+        try:
+            self.main.main()
+        except BaseException as e:
+            self.error = e
+        self.running = False
+
+    def wait_ready(self, timeout_ms=10000):
+        # Until MQTT is up and the task set is running
+        deadline = time.ticks_add(time.ticks_ms(), timeout_ms)
+        while time.ticks_diff(deadline, time.ticks_ms()) > 0:
+            if not self.running:
+                return False
+            if self.main.mqtt_connected and self.main.link_up is not None:
+                return True
+            time.sleep_ms(5)
+        return False
+
+    def topic(self, name):
+        return "chokepoint/devices/%s/%s" % (self.main.device_id, name)
@@ -0,0 +1,140 @@
+"""Stand-in for the ESP32 `machine` module.
+
+ADC readings are scriptable per pin with set_adc(); reset() and deepsleep()
+raise instead of rebooting so the harness can observe them.
+"""
+import time
+
+PWRON_RESET = 1
+HARD_RESET = 2
+WDT_RESET = 3
+DEEPSLEEP_RESET = 4
+SOFT_RESET = 5
+
+UNIQUE_ID = b"\x01\x02\x03\x04\x05\x06"
+RESET_CAUSE = PWRON_RESET
+
+_adc_sources = {}
+_rtc_memory = b""
+resets = 0
+
+
+class Reset(BaseException):
+    pass
+
+
+class DeepSleep(BaseException):
+    def __init__(self, ms):
+        super().__init__(ms)
+        self.ms = ms
+
+
+def set_adc(pin, source):
+    # source: an int, or a callable returning the next 12-bit code
+    _adc_sources[pin] = source
+
+
+def unique_id():
+    return UNIQUE_ID
+
+
+def reset_cause():
+    return RESET_CAUSE
+
+
+def reset():
+    global resets
+    resets += 1
+    raise Reset()
+
+
+def soft_reset():
+    reset()
+
+
+def deepsleep(ms=0):
+    raise DeepSleep(ms)
+
+
+def lightsleep(ms=0):
+    time.sleep(ms / 1000)
+
+
+def freq(hz=None):
+    return 240000000
+
+
+def idle():
+    pass
+
+
+class Pin:
+    IN = 1
+    OUT = 3
+    PULL_UP = 1
+    PULL_DOWN = 2
+
+    def __init__(self, pin, mode=-1, pull=-1, value=None):
+        self.pin = pin
+        self._value = value or 0
+
+    def value(self, v=None):
+        if v is None:
+            return self._value
+        self._value = v
+
+    def on(self):
+        self._value = 1
+
+    def off(self):
+        self._value = 0
+
+
+class ADC:
+    ATTN_0DB = 0
+    ATTN_2_5DB = 1
+    ATTN_6DB = 2
+    ATTN_11DB = 3
+    WIDTH_9BIT = 0
+    WIDTH_10BIT = 1
+    WIDTH_11BIT = 2
+    WIDTH_12BIT = 3
+
+    def __init__(self, pin, atten=None):
+        self.pin = pin.pin if isinstance(pin, Pin) else pin
+        self.reads = 0
+
+    def atten(self, a):
+        pass
+
+    def width(self, w):
+        pass
+
+    def read(self):
+        self.reads += 1
+        source = _adc_sources.get(self.pin, 1500)
+        return source() if callable(source) else source
+
+    def read_u16(self):
+        return self.read() << 4
+
+
+class RTC:
+    def datetime(self, dt=None):
+        if dt is None:
+            t = time.localtime()
+            return (t[0], t[1], t[2], t[6], t[3], t[4], t[5], 0)
+
+    def memory(self, data=None):
+        global _rtc_memory
+        if data is None:
+            return _rtc_memory
+        _rtc_memory = bytes(data)
+
+
+class WDT:
+    def __init__(self, id=0, timeout=5000):
+        pass
+
+    def feed(self):
+        pass
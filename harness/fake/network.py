@@ -0,0 +1,91 @@
+"""Stand-in for the ESP32 `network` module.
+
+One shared radio: STA connects succeed instantly against the APs in SCAN
+(or any SSID while SCAN is empty). Tests change RSSI, SCAN, FAIL_CONNECT
+and IP to script link conditions.
+"""
+STA_IF = 0
+AP_IF = 1
+
+STAT_IDLE = 1000
+STAT_CONNECTING = 1001
+STAT_GOT_IP = 1010
+STAT_NO_AP_FOUND = 201
+STAT_WRONG_PASSWORD = 202
+STAT_CONNECT_FAIL = 203
+
+# (ssid, bssid, channel, rssi, security, hidden), as WLAN.scan() returns
+SCAN = [(b"harness", b"\x02\x00\x00\x00\x00\x01", 6, -55, 3, False)]
+RSSI = -55
+FAIL_CONNECT = False
+IP = ("10.0.0.5", "255.255.255.0", "10.0.0.1", "10.0.0.1")
+AP_IP = ("192.168.4.1", "255.255.255.0", "192.168.4.1", "192.168.4.1")
+
+connects = 0
+scans = 0
+
+
+class WLAN:
+    PM_NONE = 0
+    PM_PERFORMANCE = 1
+    PM_POWERSAVE = 2
+
+    def __init__(self, interface=STA_IF):
+        self.interface = interface
+        self._active = False
+        self._connected = False
+        self._status = STAT_IDLE
+        self._config = {}
+        self.bssid = None
+
+    def active(self, on=None):
+        if on is None:
+            return self._active
+        self._active = bool(on)
+        if not on:
+            self._connected = False
+
+    def connect(self, ssid=None, key=None, bssid=None):
+        global connects
+        connects += 1
+        ssid_b = ssid.encode() if isinstance(ssid, str) else ssid
+        aps = [ap for ap in SCAN if ap[0] == ssid_b and (bssid is None or ap[1] == bssid)]
+        if FAIL_CONNECT or (SCAN and not aps):
+            self._connected = False
+            self._status = STAT_NO_AP_FOUND
+            return
+        self.bssid = bssid or (aps[0][1] if aps else None)
+        self._connected = True
+        self._status = STAT_GOT_IP
+
+    def disconnect(self):
+        self._connected = False
+        self._status = STAT_IDLE
+
+    def isconnected(self):
+        if self.interface == AP_IF:
+            return self._active
+        return self._connected and not FAIL_CONNECT
+
+    def status(self, param=None):
+        if param == "rssi":
+            if not self.isconnected():
+                raise OSError("not connected")
+            return RSSI
+        return self._status
+
+    def scan(self):
+        global scans
+        scans += 1
+        return list(SCAN)
+
+    def ifconfig(self, config=None):
+        if config is None:
+            return AP_IP if self.interface == AP_IF else IP
+
+    def config(self, *args, **kwargs):
+        if args:
+            if args[0] == "mac":
+                return b"\x02\x00\x00\x00\x00\xaa"
+            return self._config.get(args[0])
+        self._config.update(kwargs)
@@ -0,0 +1,138 @@
+"""Stand-in for umqtt.simple.MQTTClient, backed by broker.py.
+
+The harness sets BROKER before the firmware connects. `sock` is one end of
+a real socket pair: the broker writes a byte per packet, check_msg() reads
+one byte and handles one packet, exactly one per call like umqtt.simple.
+Setting BLACKHOLE makes connect() hang like an unanswered SYN: for the
+socket timeout, if one is given, and then fail.
+"""
+import socket
+import time
+
+BROKER = None
+BLACKHOLE = False
+BLACKHOLE_STALL_S = 30 # How long a connect with no timeout hangs
+
+
+class MQTTException(Exception):
+    pass
+
+
+_next_port = [18830]
+
+
+def _pair():
+    if hasattr(socket, "socketpair"):
+        return socket.socketpair()
+    # MicroPython unix port: a loopback TCP connection instead
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    while True:
+        addr = socket.getaddrinfo("127.0.0.1", _next_port[0])[0][-1]
+        _next_port[0] += 1
+        try:
+            listener.bind(addr)
+            break
+        except OSError:
+            pass
+    listener.listen(1)
+    a = socket.socket()
+    a.connect(addr)
+    b, _ = listener.accept()
+    listener.close()
+    return a, b
+
+
+class MQTTClient:
+    def __init__(self, client_id, server, port=0, user=None, password=None, keepalive=0,
+                 ssl=False, ssl_params=None):
+        self.client_id = client_id if isinstance(client_id, bytes) else client_id.encode()
+        self.server = server
+        self.port = port
+        self.keepalive = keepalive
+        self.cb = None
+        self.sock = None
+        self._peer = None
+        self._inbox = []
+        self._alive = False
+
+    def set_callback(self, f):
+        self.cb = f
+
+    def set_last_will(self, topic, msg, retain=False, qos=0):
+        pass
+
+    def connect(self, clean_session=True, timeout=None):
+        if BLACKHOLE:
+            time.sleep(BLACKHOLE_STALL_S if timeout is None else min(timeout, BLACKHOLE_STALL_S))
+            raise OSError(110) # ETIMEDOUT
+        if BROKER is None:
+            raise OSError("no broker")
+        self.sock, self._peer = _pair()
+        self.sock.setblocking(False)
+        self._inbox = []
+        self._alive = True
+        try:
+            return 1 if BROKER.connect(self, clean_session) else 0
+        except OSError:
+            self.kill()
+            raise
+
+    def disconnect(self):
+        if BROKER is not None:
+            BROKER.disconnect(self)
+        self.kill()
+
+    def ping(self):
+        self._check()
+        BROKER.ping(self)
+
+    def publish(self, topic, msg, retain=False, qos=0):
+        self._check()
+        BROKER.publish(topic, msg, retain, qos)
+
+    def subscribe(self, topic, qos=0):
+        self._check()
+        BROKER.subscribe(self, topic, qos)
+
+    def check_msg(self):
+        try:
+            data = self.sock.recv(1)
+        except OSError:
+            if not self._alive:
+                raise
+            return None # EAGAIN: nothing pending
+        if not data:
+            raise OSError(-1)
+        topic, msg = self._inbox.pop(0)
+        if topic is not None and self.cb:
+            self.cb(topic, msg)
+
+    def wait_msg(self):
+        self.sock.setblocking(True)
+        try:
+            return self.check_msg()
+        finally:
+            self.sock.setblocking(False)
+
+    # Broker side
+
+    def deliver(self, topic, msg):
+        if not self._alive:
+            return
+        self._inbox.append((topic, msg))
+        try:
+            self._peer.send(b"\x01")
+        except OSError:
+            pass
+
+    def kill(self):
+        self._alive = False
+        try:
+            self._peer.close()
+        except Exception:
+            pass
+
+    def _check(self):
+        if not self._alive:
+            raise OSError("connection lost")
@@ -0,0 +1,112 @@
+"""Stand-in for urequests: plain HTTP/1.0 over a socket.
+
+Requests to https://api.github.com (or any host) go to REDIRECT, the
+harness's fake OTA server, so ota.py runs unchanged.
+"""
+import json
+import socket
+
+REDIRECT = None # (host, port)
+requests = 0
+
+
+class Response:
+    def __init__(self, sock):
+        self.raw = sock.makefile("rb") if hasattr(sock, "makefile") else sock
+        self._sock = sock
+        self._content = None
+        self.status_code = 0
+        self.reason = b""
+        self.headers = {}
+        self.encoding = "utf-8"
+
+    @property
+    def content(self):
+        if self._content is None:
+            chunks = []
+            while True:
+                chunk = self.raw.read(4096)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            self._content = b"".join(chunks)
+            self.close()
+        return self._content
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding)
+
+    def json(self):
+        return json.loads(self.content)
+
+    def close(self):
+        if self._sock:
+            try:
+                self.raw.close()
+            except Exception:
+                pass
+            self._sock.close()
+            self._sock = None
+
+
+def request(method, url, data=None, json=None, headers=None, stream=None):
+    global requests
+    requests += 1
+    headers = headers or {}
+    if json is not None:
+        data = _json_dumps(json)
+        headers = dict(headers)
+        headers["Content-Type"] = "application/json"
+    if isinstance(data, str):
+        data = data.encode()
+    proto, _, host, path = url.split("/", 3)
+    port = 443 if proto == "https:" else 80
+    if ":" in host:
+        host, port = host.split(":", 1)
+        port = int(port)
+    if REDIRECT is not None:
+        host, port = REDIRECT
+    sock = socket.socket()
+    sock.connect(socket.getaddrinfo(host, port)[0][-1])
+    head = "%s /%s HTTP/1.0\r\nHost: %s\r\n" % (method, path, host)
+    for key in headers:
+        head += "%s: %s\r\n" % (key, headers[key])
+    if data:
+        head += "Content-Length: %d\r\n" % len(data)
+    sock.send(head.encode() + b"\r\n")
+    if data:
+        sock.send(data)
+
+    resp = Response(sock)
+    line = resp.raw.readline().split(None, 2)
+    resp.status_code = int(line[1])
+    if len(line) > 2:
+        resp.reason = line[2].rstrip()
+    while True:
+        line = resp.raw.readline()
+        if not line or line == b"\r\n":
+            break
+        key, _, value = line.decode().partition(":")
+        resp.headers[key.strip()] = value.strip()
+    return resp
+
+
+def _json_dumps(obj):
+    return json.dumps(obj)
+
+
+def get(url, **kw):
+    return request("GET", url, **kw)
+
+
+def post(url, **kw):
+    return request("POST", url, **kw)
+
+
+def put(url, **kw):
+    return request("PUT", url, **kw)
+
+
+def head(url, **kw):
+    return request("HEAD", url, **kw)
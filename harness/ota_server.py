@@ -0,0 +1,81 @@
+"""Fake GitHub contents API for OTA runs.
+
+Serves GET /repos/{owner}/{repo}/contents/{path} from an in-memory dict of
+repo paths, with an ETag per file and 304 replies to a matching
+If-None-Match, which is all ota.github_update() needs.
+"""
+import hashlib
+import socket
+import _thread
+import binascii
+
+
+class OtaServer:
+    def __init__(self, files, port=18080):
+        self.files = files # "firmware/main.py" -> bytes
+        self.port = port
+        self.requests = 0
+        self.not_modified = 0
+        self.bytes_sent = 0
+        self.sock = None
+
+    def start(self):
+        self.sock = socket.socket()
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        while True:
+            try:
+                self.sock.bind(socket.getaddrinfo("127.0.0.1", self.port)[0][-1])
+                break
+            except OSError:
+                self.port += 1
+        self.sock.listen(4)
+        _thread.start_new_thread(self._serve, ())
+        return "127.0.0.1", self.port
+
+    def etag(self, data):
+        return '"%s"' % binascii.hexlify(hashlib.sha1(data).digest()).decode()
+
+    def _serve(self):
+        while True:
+            try:
+                cl, _ = self.sock.accept()
+            except OSError:
+                return
+            try:
+                self._handle(cl)
+            except Exception as e:
+                print("OtaServer:", e)
+            cl.close()
+
+    def _handle(self, cl):
+        f = cl.makefile("rb") if hasattr(cl, "makefile") else cl
+        line = f.readline().decode().split()
+        headers = {}
+        while True:
+            h = f.readline()
+            if not h or h == b"\r\n":
+                break
+            key, _, value = h.decode().partition(":")
+            headers[key.strip().lower()] = value.strip()
+        self.requests += 1
+        path = line[1].split("?")[0] if len(line) > 1 else "/"
+        parts = path.split("/", 5) # "", repos, owner, repo, contents, path
+        data = self.files.get(parts[5]) if len(parts) == 6 and parts[4] == "contents" else None
+        if data is None:
+            self._reply(cl, "404 Not Found", b"{}")
+        elif headers.get("if-none-match") == self.etag(data):
+            self.not_modified += 1
+            self._reply(cl, "304 Not Modified", b"", self.etag(data))
+        else:
+            self._reply(cl, "200 OK", data, self.etag(data))
+
+    def _reply(self, cl, status, body, etag=None):
+        head = "HTTP/1.0 %s\r\nContent-Length: %d\r\n" % (status, len(body))
+        if etag:
+            head += "ETag: %s\r\n" % etag
+        cl.send(head.encode() + b"\r\n")
+        view = memoryview(body)
+        while len(view):
+            n = cl.send(view)
+            view = view[n:]
+        self.bytes_sent += len(body)
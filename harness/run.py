@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""Run the firmware on the host and report loop throughput, command latency
+and memory use.
+
+    python3 harness/run.py                  # ota, loop and latency
+    python3 harness/run.py loop --seconds 20 --sample-ms 10
+    python3 harness/run.py latency --commands 200 --json
+    micropython harness/run.py loop         # MicroPython unix port
+
+The firmware in firmware/ runs unchanged: device.py swaps in fakes for
+machine, network, umqtt.simple and urequests, an in-process broker stands
+in for RabbitMQ and a local server for the GitHub contents API. The device
+filesystem is a scratch directory (--fs), wiped on every run.
+"""
+import sys
+import time
+import json
+import hashlib
+import builtins
+import random
+
+import device
+
+_print = print
+SCENARIOS = ("ota", "loop", "latency")
+
+
+def parse_args(argv):
+    opts = {"scenarios": [], "seconds": 10, "sample_ms": 100, "format": "json",
+            "commands": 100, "drop_every": 0, "fs": "/tmp/chokepoint-harness",
+            "json": False, "verbose": False}
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg in SCENARIOS:
+            opts["scenarios"].append(arg)
+        elif arg in ("--json", "--verbose"):
+            opts[arg[2:]] = True
+        elif arg.startswith("--") and arg[2:].replace("-", "_") in opts and i + 1 < len(argv):
+            key = arg[2:].replace("-", "_")
+            value = argv[i + 1]
+            opts[key] = value if isinstance(opts[key], str) else type(opts[key])(value)
+            i += 1
+        else:
+            raise SystemExit("unknown argument: %s\n%s" % (arg, __doc__))
+        i += 1
+    if not opts["scenarios"]:
+        opts["scenarios"] = list(SCENARIOS)
+    return opts
+
+
+def hexdigest(h):
+    return "".join("%02x" % b for b in h.digest())
+
+
+def memory():
+    # Heap in use, from tracemalloc on CPython or the GC on MicroPython
+    try:
+        import tracemalloc
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            return {"current_kb": current // 1024, "peak_kb": peak // 1024}
+    except ImportError:
+        pass
+    import gc
+    if hasattr(gc, "mem_alloc"):
+        return {"current_kb": gc.mem_alloc() // 1024, "free_kb": gc.mem_free() // 1024}
+    return {}
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, len(values) * pct // 100)]
+
+
+def adc_source():
+    # Slow drift with noise around a fresh-air reading
+    state = [1500.0]
+
+    def read():
+        state[0] += random.uniform(-4, 4) + (1500 - state[0]) * 0.01
+        return int(state[0])
+    return read
+
+
+def run_ota(fs):
+    # Three manifest updates against the fake GitHub API: a device that has
+    # never updated (every file downloads), an unchanged manifest (304) and
+    # a release that changes one file
+    import ota
+    from ota_server import OtaServer
+    import fake.urequests
+
+    files = {}
+    for name in sorted(device.os.listdir(device.FIRMWARE_DIR)):
+        if name.endswith(".py") and name not in ("secrets.py", "main_v1_0_1.py", "scan.py"):
+            with open(device.FIRMWARE_DIR + "/" + name, "rb") as f:
+                files[name] = f.read()
+
+    def publish(files):
+        manifest = {"files": {}}
+        for name in files:
+            manifest["files"][name] = {"sha256": hexdigest(hashlib.sha256(files[name])), "size": len(files[name])}
+        served = {"firmware/" + name: files[name] for name in files}
+        served["firmware/manifest.json"] = json.dumps(manifest).encode()
+        return served
+
+    server = OtaServer(publish(files))
+    fake.urequests.REDIRECT = server.start()
+    results = []
+    for step in ("fresh", "unchanged", "one_file"):
+        if step == "one_file":
+            files["config.py"] = files["config.py"] + b"\n# harness release\n"
+            server.files = publish(files)
+        sent = server.bytes_sent
+        t = time.ticks_us()
+        changed = ota.github_update("harness", "chokepoint", "harness", "firmware/manifest.json")
+        results.append({"step": step, "changed": changed,
+                        "ms": time.ticks_diff(time.ticks_us(), t) / 1000,
+                        "bytes": server.bytes_sent - sent})
+    # Leave an empty device filesystem for the firmware run
+    device.prepare_fs(fs)
+    return {"updates": results, "requests": server.requests, "not_modified": server.not_modified}
+
+
+def run_loop(dev, broker, opts):
+    main = dev.main
+    data = [dev.topic("data"), dev.topic("bin")]
+    adc = main.sensor_array.primary.adc
+    start_reads = adc.reads
+    start_msgs = sum(broker.count(t) for t in data)
+    start_log = len(broker.log)
+    drops = 0
+    t0 = time.ticks_ms()
+    next_drop = opts["drop_every"] * 1000 or None
+    while time.ticks_diff(time.ticks_ms(), t0) < opts["seconds"] * 1000:
+        time.sleep_ms(50)
+        if next_drop is not None and time.ticks_diff(time.ticks_ms(), t0) >= next_drop:
+            broker.drop(main.device_id.encode())
+            drops += 1
+            next_drop += opts["drop_every"] * 1000
+    elapsed = time.ticks_diff(time.ticks_ms(), t0) / 1000
+    msgs = sum(broker.count(t) for t in data) - start_msgs
+    payload = 0
+    for _, topic, msg in broker.log[start_log:]:
+        if topic.decode() in data:
+            payload += len(msg)
+    return {
+        "seconds": elapsed,
+        "sample_ms": opts["sample_ms"],
+        "samples_per_s": round((adc.reads - start_reads) / elapsed, 1),
+        "messages_per_s": round(msgs / elapsed, 1),
+        "payload_bytes_per_s": round(payload / elapsed),
+        "overruns": main.stats.overruns,
+        "drops": drops,
+        "reconnects": main.stats.reconnects
+    }
+
+
+def run_latency(dev, broker, opts):
+    # Broker-to-response time for {"cmd": "stats"}, one command at a time
+    cmd = dev.topic("cmd")
+    res = dev.topic("res").encode()
+    latencies = []
+    lost = 0
+    for i in range(opts["commands"]):
+        cmd_id = "h%d" % i
+        start = len(broker.log)
+        t = time.ticks_us()
+        broker.publish(cmd, json.dumps({"cmd": "stats", "id": cmd_id}), qos=1)
+        tag = ('"id": "%s"' % cmd_id).encode()
+        hit = broker.wait_for(lambda topic, msg: topic == res and tag in msg, 2000, start)
+        if hit is None:
+            lost += 1
+        else:
+            latencies.append(time.ticks_diff(hit[1], t))
+    return {
+        "commands": opts["commands"],
+        "lost": lost,
+        "p50_us": percentile(latencies, 50),
+        "p99_us": percentile(latencies, 99),
+        "max_us": max(latencies) if latencies else None
+    }
+
+
+def report(results, as_json):
+    if as_json:
+        _print(json.dumps(results))
+        return
+    for name in results:
+        _print("%s:" % name)
+        section = results[name]
+        for key in section:
+            _print("  %-20s %s" % (key, section[key]))
+
+
+def main(argv):
+    opts = parse_args(argv)
+    try:
+        import tracemalloc
+        tracemalloc.start()
+    except ImportError:
+        pass
+    device.install()
+    fs = device.prepare_fs(opts["fs"])
+    if not opts["verbose"]:
+        builtins.print = lambda *args, **kwargs: None # Firmware logging
+
+    import machine
+    machine.set_adc(34, adc_source())
+    results = {}
+    if "ota" in opts["scenarios"]:
+        results["ota"] = run_ota(fs)
+
+    if "loop" in opts["scenarios"] or "latency" in opts["scenarios"]:
+        from broker import Broker
+        broker = Broker()
+        dev = device.Device(broker, {
+            "SAMPLE_PERIOD_MS": opts["sample_ms"],
+            "MIN_SAMPLE_PERIOD_MS": min(opts["sample_ms"], 100),
+            "TELEMETRY_FORMAT": opts["format"],
+            "GITHUB_PAT": "",
+        })
+        before = memory()
+        dev.boot()
+        if not dev.wait_ready():
+            raise SystemExit("firmware did not come up: %r" % (dev.error,))
+        results["boot"] = {"memory_before": before, "memory_after": memory()}
+        if "loop" in opts["scenarios"]:
+            results["loop"] = run_loop(dev, broker, opts)
+        if "latency" in opts["scenarios"]:
+            results["latency"] = run_latency(dev, broker, opts)
+        results["memory"] = memory()
+        if dev.error is not None:
+            results["error"] = {"firmware": repr(dev.error)}
+
+    report(results, opts["json"])
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
+    try:
+        sys.stdout.flush()
+    except AttributeError:
+        pass
+    # The firmware thread never returns; do not wait for it
+    import os
+    if hasattr(os, "_exit"):
+        os._exit(0)
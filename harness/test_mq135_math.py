@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""Parity checks for mq135_math's lookup table.
+
+    python3 -m pytest harness/test_mq135_math.py
+    python3 harness/test_mq135_math.py       # no pytest needed
+    micropython harness/test_mq135_math.py   # single-precision floats
+
+Table lookups (get_ppm in table mode and get_ppm_many) must match the
+formula for every ADC code, including the clamped ends of the range, and
+a new R0 must rebuild the table.
+"""
+import sys
+from array import array
+
+import device
+
+device.install()
+
+import mq135_math
+
+R0_VALUES = (mq135_math.DEFAULT_R0, 10.0, 250.0)
+
+
+def check_parity(r0):
+    mq135_math.build_table(r0)
+    codes = array('H', range(mq135_math.ADC_CODES))
+    out = array(mq135_math._TYPECODE, bytearray(mq135_math.ADC_CODES * mq135_math._ITEMSIZE))
+    mq135_math.get_ppm_many(codes, out)
+    for code in range(mq135_math.ADC_CODES):
+        expected = mq135_math._compute_ppm(code, r0)
+        assert mq135_math.get_ppm(code, r0) == expected, (r0, code)
+        assert out[code] == expected, (r0, code)
+    assert mq135_math.get_ppm(-5, r0) == mq135_math._compute_ppm(-5, r0)
+    assert mq135_math.get_ppm(5000, r0) == mq135_math._compute_ppm(5000, r0)
+
+
+def test_table_matches_formula():
+    for r0 in R0_VALUES:
+        check_parity(r0)
+
+
+def test_new_r0_rebuilds_table():
+    mq135_math.build_table(mq135_math.DEFAULT_R0)
+    ppm = mq135_math.get_ppm(2000, 10.0)
+    assert mq135_math._table_r0 == 10.0
+    assert ppm == mq135_math._compute_ppm(2000, 10.0)
+
+
+def test_many_needs_table():
+    mq135_math._table = None
+    try:
+        mq135_math.get_ppm_many(array('H', [0]), array(mq135_math._TYPECODE, [0.0]))
+    except ValueError:
+        return
+    raise AssertionError("get_ppm_many ran without a table")
+
+
+def main():
+    failed = 0
+    for name, fn in sorted(globals().items()):
+        if name.startswith("test_") and callable(fn):
+            try:
+                fn()
+                print("ok  ", name)
+            except AssertionError as e:
+                failed += 1
+                print("FAIL", name, e)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
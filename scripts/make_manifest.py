@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""Regenerate firmware/manifest.json for manifest-based OTA updates.
+
+Devices compare each file's sha256 against their local index and download
+only what changed. Run this and commit the result whenever firmware/ changes:
+
+    python3 scripts/make_manifest.py
+"""
+import hashlib
+import json
+import os
+import sys
+
+FIRMWARE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "firmware")
+MANIFEST = "manifest.json"
+
+# Device-local or debug-only files that must never be pushed over the air
+EXCLUDE = {"secrets.py", "main_v1_0_1.py", "scan.py"}
+
+
+def build_manifest(firmware_dir=FIRMWARE_DIR):
+    files = {}
+    for name in sorted(os.listdir(firmware_dir)):
+        if not name.endswith(".py") or name in EXCLUDE:
+            continue
+        with open(os.path.join(firmware_dir, name), "rb") as f:
+            data = f.read()
+        files[name] = {"sha256": hashlib.sha256(data).hexdigest(), "size": len(data)}
+    return {"files": files}
+
+
+def main():
+    firmware_dir = sys.argv[1] if len(sys.argv) > 1 else FIRMWARE_DIR
+    manifest = build_manifest(firmware_dir)
+    path = os.path.join(firmware_dir, MANIFEST)
+    with open(path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print("Wrote %s (%d files)" % (os.path.normpath(path), len(manifest["files"])))
+
+
+if __name__ == "__main__":
+    main()
@@ -31,7 +31,7 @@ const client = mqtt.connect(MQTT_URL, {
 
 client.on('connect', () => {
     console.log("Connected to CloudAMQP Broker via standard TCP.");
-    client.subscribe(['chokepoint/devices/+/data', 'chokepoint/devices/+/res'], (err) => {
+    client.subscribe(['chokepoint/devices/+/data', 'chokepoint/devices/+/batch', 'chokepoint/devices/+/bin', 'chokepoint/devices/+/res'], (err) => {
         if (!err) {
             console.log("Subscribed to all device telemetry and response streams.");
             console.log("Listening for device pings and commands...");
@@ -81,13 +81,62 @@ wss.on('connection', (ws) => {
 });
 
 
+// --- Binary telemetry (see firmware/wire.py for the frame layout) ---
+const WIRE_ERRORS = { 1: "Hardware Fault: Invalid Voltage", 2: "Sensor Read Error" };
+const wireFields = {}; // deviceId -> value names from the last info frame
+
+function decodeWire(deviceId, buf) {
+    if (buf.length < 6 || buf.toString('latin1', 0, 2) !== 'CP' || buf[2] !== 1) {
+        throw new Error("Unsupported binary frame");
+    }
+    const kind = buf[3], count = buf[4], nvals = buf[5];
+    let off = 6;
+    if (kind === 2) {
+        const idLen = buf[off];
+        off += 1 + idLen;
+        const localIp = Array.from(buf.subarray(off, off + 4)).join('.');
+        off += 4;
+        const namesLen = buf[off];
+        wireFields[deviceId] = buf.toString('utf8', off + 1, off + 1 + namesLen).split(',');
+        return { device_id: deviceId, local_ip: localIp, samples: [] };
+    }
+    const names = wireFields[deviceId] || ['co2'];
+    const samples = [];
+    for (let i = 0; i < count; i++) {
+        const sample = {
+            timestamp: buf.readUInt32LE(off),
+            gas_raw: buf.readInt16LE(off + 4),
+            error: buf[off + 6] ? (WIRE_ERRORS[buf[off + 6]] || `Error ${buf[off + 6]}`) : null
+        };
+        off += 7;
+        for (let j = 0; j < nvals; j++, off += 4) {
+            sample[names[j] || `val${j}`] = buf.readFloatLE(off);
+        }
+        samples.push(sample);
+    }
+    return { device_id: deviceId, samples: samples };
+}
+
 client.on('message', async (topic, message) => {
     try {
-        const payload = JSON.parse(message.toString());
+        const payload = topic.endsWith('/bin')
+            ? decodeWire(topic.split('/')[2], message)
+            : JSON.parse(message.toString());
         const deviceId = payload.device_id;
 
         if (!deviceId) return;
 
+        // Batched payloads carry rows of `fields`; expand them into normal readings
+        let samples = [payload];
+        if (Array.isArray(payload.samples)) {
+            samples = !payload.fields ? payload.samples : payload.samples.map(row => {
+                const sample = {};
+                payload.fields.forEach((field, i) => { sample[field] = row[i]; });
+                return sample;
+            });
+        }
+        const latest = samples[samples.length - 1];
+
         console.log(`[${new Date().toLocaleTimeString()}] Ping caught from device: ${deviceId}`);
 
         // 1. Update the 'lastSeen' heartbeat & metadata on the main device document
@@ -102,8 +151,10 @@ client.on('message', async (topic, message) => {
             updateData.lastIp = payload.local_ip;
         }
 
-        if (payload.error) {
-            updateData.sensorError = payload.error;
+        if (!latest) {
+            // Info frame: metadata only, sensor state unchanged
+        } else if (latest.error) {
+            updateData.sensorError = latest.error;
         } else {
             updateData.sensorError = admin.firestore.FieldValue.delete();
         }
@@ -118,19 +169,23 @@ client.on('message', async (topic, message) => {
         // MicroPython uses Jan 1 2000 as epoch, Unix uses Jan 1 1970. 
         // Offset is exactly 946,684,800 seconds.
         const MP_EPOCH_OFFSET = 946684800;
-        const unixTimestamp = (payload.timestamp || 0) + MP_EPOCH_OFFSET;
-
-        const readingData = {
-            co2: payload.co2 || 0,
-            nh3: payload.nh3 || 0,
-            smoke: payload.smoke || 0,
-            gasRaw: payload.gas_raw || Math.floor(payload.co2 || 0),
-            timestamp: admin.firestore.Timestamp.fromMillis(unixTimestamp * 1000),
-            deviceId: deviceId,
-            airQuality: (payload.smoke > 0.5) ? "Hazardous" : ((payload.co2 > 1000) ? "Poor" : "Good")
-        };
-
-        await deviceRef.collection('readings').add(readingData);
+        const readings = deviceRef.collection('readings');
+
+        for (const sample of samples) {
+            const unixTimestamp = (sample.timestamp || 0) + MP_EPOCH_OFFSET;
+
+            const readingData = {
+                co2: sample.co2 || 0,
+                nh3: sample.nh3 || 0,
+                smoke: sample.smoke || 0,
+                gasRaw: sample.gas_raw || Math.floor(sample.co2 || 0),
+                timestamp: admin.firestore.Timestamp.fromMillis(unixTimestamp * 1000),
+                deviceId: deviceId,
+                airQuality: (sample.smoke > 0.5) ? "Hazardous" : ((sample.co2 > 1000) ? "Poor" : "Good")
+            };
+
+            await readings.add(readingData);
+        }
 
     } catch (e) {
         console.error("Error processing MQTT message:", e.message);